@@ -8,6 +8,7 @@
 # 4- instance domain (https:// is automatically added)
 # 5- max age (in days)
 # 6- footer tags to add (optional)
+# 7- minimum delay between polls, in seconds (optional, see --adaptive-polling)
 
 python3 tootbot.py geonym_fr geonym@amicale.net **password** test.amicale.net
 python3 tootbot.py cq94 cquest@amicale.net **password** test.amicale.net
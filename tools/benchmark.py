@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+
+# End-to-end benchmark of tootbot: synthetic tweets are replayed (see `--replay`) and posted to a stand-in Mastodon
+#   server (see `fake_mastodon.py`), in a temporary directory, so nothing leaves the machine.
+# Each run reports its duration, the posted toots per second, and the toots left in the retry queue. With `--runs`,
+#   next runs retry the queued toots right away, to measure how the retry queue drains.
+#
+# Examples:
+#   python3 tools/benchmark.py --tweets 500
+#   python3 tools/benchmark.py --tweets 500 --latency 0.05 --error-502 0.1 --runs 3 -- --pipeline 4 --parallel-conversations 4
+
+import argparse
+import json
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_mastodon import FakeMastodonServer
+
+
+############################################################################################
+# Configuration
+
+# Twitter ids epoch (in milliseconds), to forge tweet ids.
+kTWITTER_EPOCH = 1288834974657
+
+kTOOTBOT_PATH = Path(__file__).resolve().parent.parent.joinpath('tootbot.py')
+
+
+
+############################################################################################
+# Helpers
+
+# Forge tweets, oldest last like twint: a share of them are replies in the account threads, or quote a previous tweet.
+def forge_tweets(twitter_account, count, threads_rate, quotes_rate, seed):
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    tweets = []
+
+    for tweet_nbr in range(count):
+        tweet_id = (now_ms - kTWITTER_EPOCH - (count - tweet_nbr) * 60000) << 22
+        conversation_id = tweet_id
+        quote_url = ''
+
+        if len(tweets) > 0 and rng.random() < threads_rate:
+            conversation_id = int(rng.choice(tweets[-10:])['conversation_id'])
+        elif len(tweets) > 0 and rng.random() < quotes_rate:
+            quote_url = 'https://twitter.com/%s/status/%s' % (twitter_account, rng.choice(tweets)['id'])
+
+        tweets.append({
+            'id': tweet_id,
+            'conversation_id': str(conversation_id),
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S UTC', time.gmtime((tweet_id >> 22) / 1000 + kTWITTER_EPOCH / 1000)),
+            'username': twitter_account,
+            'tweet': 'Benchmark tweet %s %s' % (tweet_nbr, ' '.join(rng.choice([ 'lorem', 'ipsum', 'dolor', 'sit', 'amet' ]) for _ in range(rng.randint(5, 40)))),
+            'link': 'https://twitter.com/%s/status/%s' % (twitter_account, tweet_id),
+            'reply_to': [],
+            'photos': [],
+            'quote_url': quote_url
+            })
+
+    return list(reversed(tweets))
+
+
+
+############################################################################################
+# Main
+
+# Parse arguments.
+parser = argparse.ArgumentParser(prog = 'benchmark.py')
+
+parser.add_argument('--tweets', type = int, default = 200, help = 'number of replayed tweets (default: 200)')
+parser.add_argument('--threads', type = float, default = 0.3, help = 'rate of tweets replying in a thread (default: 0.3)')
+parser.add_argument('--quotes', type = float, default = 0, help = 'rate of tweets quoting a previous one, their links being resolved on the network (default: 0)')
+parser.add_argument('--runs', type = int, default = 1, help = 'number of runs, next ones retrying queued toots (default: 1)')
+parser.add_argument('--latency', type = float, default = 0, help = 'average latency of the server, in seconds')
+parser.add_argument('--error-422', type = float, default = 0, help = 'rate of posting calls failing with a 422 error')
+parser.add_argument('--error-500', type = float, default = 0, help = 'rate of posting calls failing with a 500 error')
+parser.add_argument('--error-502', type = float, default = 0, help = 'rate of posting calls failing with a 502 error')
+parser.add_argument('--rate-limit', type = int, default = 0, help = 'posting calls allowed per 5 minutes (default: unlimited)')
+parser.add_argument('--seed', type = int, default = 0)
+parser.add_argument('--keep', action = 'store_true', help = 'keep the temporary directory, and print its path')
+parser.add_argument('tootbot_args', nargs = '*', help = 'extra tootbot arguments, after "--"')
+
+args = parser.parse_args()
+
+
+# Start server.
+server = FakeMastodonServer(('127.0.0.1', 0), args.latency, { 422: args.error_422, 500: args.error_500, 502: args.error_502 },
+                            0, 500, args.rate_limit, args.seed)
+threading.Thread(target = server.serve_forever, daemon = True).start()
+
+instance = '127.0.0.1:%s' % server.server_address[1]
+
+
+# Prepare directory and tweets.
+work_dir = Path(tempfile.mkdtemp(prefix = 'tootbot-benchmark-'))
+tweets_path = work_dir.joinpath('tweets.json')
+
+with open(tweets_path, 'w') as file:
+    json.dump(forge_tweets('benchmark', args.tweets, args.threads, args.quotes, args.seed), file)
+
+
+# Run.
+print('%s tweets, server latency %ss, errors 422/500/502 %s/%s/%s, tootbot args: %s' %
+      (args.tweets, args.latency, args.error_422, args.error_500, args.error_502, ' '.join(args.tootbot_args) or '-'))
+
+for run_nbr in range(args.runs):
+
+    # > Retry queued toots right away.
+    database_path = work_dir.joinpath('benchmark', 'tootbot.db')
+
+    if database_path.exists():
+        with sqlite3.connect(database_path) as sql:
+            sql.execute('UPDATE retries SET next_attempt_at = 0')
+
+    posted_before = len(server.stats()['statuses'])
+    start = time.monotonic()
+
+    result = subprocess.run([ sys.executable, str(kTOOTBOT_PATH), 'benchmark', 'bot@localhost', 'password', instance,
+                              '--instance-scheme', 'http', '--replay', str(tweets_path) ] + args.tootbot_args,
+                            cwd = work_dir, capture_output = True, text = True)
+
+    duration = time.monotonic() - start
+    stats = server.stats()
+    posted = len(stats['statuses']) - posted_before
+
+    with sqlite3.connect(database_path) as sql:
+        queued = sql.execute('SELECT COUNT(*) FROM retries').fetchone()[0]
+
+    print('run %s: %.2fs, %s toots posted (%.1f/s), %s queued, exit code %s' % (run_nbr + 1, duration, posted, posted / duration, queued, result.returncode))
+
+    if result.returncode != 0:
+        print(result.stdout[-2000:], result.stderr[-2000:])
+
+print('server calls:', ', '.join('%s %s' % (name, count) for name, count in sorted(stats['counters'].items())))
+
+
+# Clean up.
+server.shutdown()
+
+if args.keep:
+    print('directory:', work_dir)
+else:
+    shutil.rmtree(work_dir)
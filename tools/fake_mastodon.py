@@ -0,0 +1,278 @@
+#! /usr/bin/env python3
+
+# Stand-in Mastodon server, covering the API used by tootbot, to test and benchmark it without posting to a real instance.
+# It answers apps creation, login, instance configuration, medias uploads and statuses posts, with configurable latency,
+#   errors injection and medias processing delays. Posted statuses are kept in memory, and can be fetched on '/_fake/stats'.
+#
+# Run tootbot against it with `--instance-scheme http`:
+#   python3 tools/fake_mastodon.py --port 8080
+#   python3 tootbot.py <twitter_account> bot@localhost password localhost:8080 --instance-scheme http --replay tweets.json
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+
+############################################################################################
+# Server
+
+class FakeMastodonServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, latency = 0, error_rates = None, media_processing = 0, max_characters = 500, rate_limit = 0, seed = None):
+        super().__init__(address, FakeMastodonHandler)
+
+        self.latency = latency
+        self.error_rates = error_rates or { }
+        self.media_processing = media_processing
+        self.max_characters = max_characters
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.medias = { }
+        self.statuses = [ ]
+        self.counters = { }
+        self.rate_limit_window = (0, 0)
+
+    # Count an event, for '/_fake/stats'.
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    # Pick an injected error for a posting request, or None.
+    def injected_error(self):
+        with self.lock:
+            draw = self.random.random()
+
+        for code, rate in sorted(self.error_rates.items()):
+            if draw < rate:
+                return code
+
+            draw -= rate
+
+        return None
+
+    # Consume a call from the rate limit window (5 minutes, like Mastodon). Return the headers, and whether the limit is reached.
+    def rate_limit_call(self):
+        if self.rate_limit <= 0:
+            return ({ }, False)
+
+        with self.lock:
+            now = time.time()
+            window_start, calls = self.rate_limit_window
+
+            if now - window_start >= 300:
+                window_start, calls = (now, 0)
+
+            calls += 1
+            self.rate_limit_window = (window_start, calls)
+
+        reset = datetime.fromtimestamp(window_start + 300, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        headers = { 'X-RateLimit-Limit': str(self.rate_limit), 'X-RateLimit-Remaining': str(max(self.rate_limit - calls, 0)), 'X-RateLimit-Reset': reset }
+
+        return (headers, calls > self.rate_limit)
+
+    def stats(self):
+        with self.lock:
+            return { 'counters': dict(self.counters), 'medias': len(self.medias), 'statuses': list(self.statuses) }
+
+
+class FakeMastodonHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, code, body, headers = None):
+        data = json.dumps(body).encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+
+        for name, value in (headers or { }).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_params(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type') or ''
+
+        if content_type.startswith('application/json'):
+            return json.loads(data or b'{}')
+
+        if content_type.startswith('multipart/form-data'):
+            return { 'size': len(data) }
+
+        params = { }
+
+        for name, value in parse_qsl(data.decode(), keep_blank_values = True):
+            if name.endswith('[]'):
+                params.setdefault(name[:-2], []).append(value)
+            else:
+                params[name] = value
+
+        return params
+
+    def handle_request(self, method):
+        server = self.server
+        path = urlsplit(self.path).path.rstrip('/')
+        params = self.read_params() if method in { 'POST', 'PUT', 'PATCH' } else { }
+
+        server.count(method + ' ' + path.rstrip('/0123456789'))
+
+        if server.latency > 0:
+            time.sleep(server.random.uniform(0.5, 1.5) * server.latency)
+
+        # > Fake server introspection.
+        if path == '/_fake/stats':
+            return self.send_json(200, server.stats())
+
+        # > Applications and login.
+        if method == 'POST' and path == '/api/v1/apps':
+            return self.send_json(200, { 'id': '1', 'name': params.get('client_name'), 'client_id': 'fake-client-id', 'client_secret': 'fake-client-secret' })
+
+        if method == 'POST' and path == '/oauth/token':
+            return self.send_json(200, { 'access_token': 'fake-access-token', 'token_type': 'Bearer', 'scope': 'read write', 'created_at': int(time.time()) })
+
+        # > Instance configuration.
+        if method == 'GET' and path in { '/api/v1/instance', '/api/v2/instance' }:
+            return self.send_json(200, {
+                'uri': self.headers.get('Host'),
+                'title': 'Fake Mastodon',
+                'version': '4.1.0',
+                'configuration': {
+                    'statuses': { 'max_characters': server.max_characters, 'max_media_attachments': 4 },
+                    'media_attachments': { 'image_size_limit': 10485760, 'video_size_limit': 41943040 }
+                    }
+                })
+
+        # > Posting calls, subject to rate limit and errors injection.
+        if method == 'POST' and path in { '/api/v1/media', '/api/v2/media', '/api/v1/statuses' }:
+            headers, limited = server.rate_limit_call()
+
+            if limited:
+                server.count('rate_limited')
+                return self.send_json(429, { 'error': 'Too many requests' }, headers)
+
+            error_code = server.injected_error()
+
+            if error_code is not None:
+                server.count('injected_' + str(error_code))
+                return self.send_json(error_code, { 'error': 'Injected error' }, headers)
+
+            if path == '/api/v1/statuses':
+                return self.post_status(params, headers)
+
+            return self.post_media(params, headers)
+
+        if method == 'GET' and path.startswith('/api/v1/media/'):
+            media = server.medias.get(path.rsplit('/', 1)[-1])
+
+            if media is None:
+                return self.send_json(404, { 'error': 'Record not found' })
+
+            return self.send_json(200 if media['ready_at'] <= time.time() else 206, media['body'])
+
+        self.send_json(404, { 'error': 'Record not found' })
+
+    def post_media(self, params, headers):
+        server = self.server
+
+        with server.lock:
+            media_id = str(len(server.medias) + 1)
+            media = {
+                'ready_at': time.time() + server.media_processing,
+                'body': { 'id': media_id, 'type': 'image', 'url': None, 'preview_url': None, 'description': None }
+                }
+            server.medias[media_id] = media
+
+        return self.send_json(202 if server.media_processing > 0 else 200, media['body'], headers)
+
+    def post_status(self, params, headers):
+        server = self.server
+        status = params.get('status') or ''
+        media_ids = params.get('media_ids') or []
+
+        if len(status) > server.max_characters:
+            return self.send_json(422, { 'error': 'Validation failed: Text character limit of %s exceeded' % server.max_characters }, headers)
+
+        if len(status.strip()) == 0 and len(media_ids) == 0:
+            return self.send_json(422, { 'error': 'Validation failed: Text can\'t be blank' }, headers)
+
+        if len(media_ids) > 4:
+            return self.send_json(422, { 'error': 'Validation failed: Cannot attach more than 4 files' }, headers)
+
+        for media_id in media_ids:
+            media = server.medias.get(str(media_id))
+
+            if media is not None and media['ready_at'] > time.time():
+                server.count('media_processing')
+                return self.send_json(422, { 'error': 'Cannot attach files that have not finished processing. Try again in a moment!' }, headers)
+
+        with server.lock:
+            status_id = str(len(server.statuses) + 1)
+            server.statuses.append({ 'id': status_id, 'status': status, 'in_reply_to_id': params.get('in_reply_to_id'), 'media_ids': media_ids, 'posted_at': time.time() })
+
+        return self.send_json(200, {
+            'id': status_id,
+            'content': status,
+            'in_reply_to_id': params.get('in_reply_to_id'),
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'media_attachments': [ ]
+            }, headers)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_PATCH(self):
+        self.handle_request('PATCH')
+
+
+
+############################################################################################
+# Main
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog = 'fake_mastodon.py')
+
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--latency', type = float, default = 0, help = 'average latency added to each request, in seconds')
+    parser.add_argument('--error-422', type = float, default = 0, help = 'rate of posting calls failing with a 422 error')
+    parser.add_argument('--error-500', type = float, default = 0, help = 'rate of posting calls failing with a 500 error')
+    parser.add_argument('--error-502', type = float, default = 0, help = 'rate of posting calls failing with a 502 error')
+    parser.add_argument('--media-processing', type = float, default = 0, help = 'time during which uploaded medias are processing, in seconds')
+    parser.add_argument('--max-characters', type = int, default = 500)
+    parser.add_argument('--rate-limit', type = int, default = 0, help = 'posting calls allowed per 5 minutes (default: unlimited)')
+    parser.add_argument('--seed', type = int, default = None, help = 'seed of the errors injection')
+
+    args = parser.parse_args()
+
+    server = FakeMastodonServer((args.host, args.port), args.latency, { 422: args.error_422, 500: args.error_500, 502: args.error_502 },
+                                args.media_processing, args.max_characters, args.rate_limit, args.seed)
+
+    print('fake Mastodon server listening on http://%s:%s' % (args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
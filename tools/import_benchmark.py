@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+# Measure the cold start of tootbot: the time spent importing `tootbotlib.main`, with `python -X importtime`, in fresh
+#   interpreters. It reports the median total, the slowest modules, and checks that the heavy modules, which are only
+#   needed once there is something to post, are not imported at startup.
+#
+# Examples:
+#   python3 tools/import_benchmark.py
+#   python3 tools/import_benchmark.py --runs 10 --max-ms 150
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+############################################################################################
+# Configuration
+
+kPACKAGE_PATH = Path(__file__).resolve().parent.parent
+
+# Modules which must not be imported by `tootbotlib.main` itself.
+kLAZY_MODULES = [ 'mastodon', 'requests', 'feedparser', 'decimal', 'concurrent.futures', 'cProfile', 'tracemalloc',
+                  'tootbotlib.posting', 'tootbotlib.links', 'tootbotlib.media' ]
+
+
+
+############################################################################################
+# Helpers
+
+# Import a module in a fresh interpreter. Return its cumulative import time, the cumulative times of the modules it
+#   imports directly (in microseconds), and all the imported modules.
+def measure_import(module):
+    code = 'import sys, %s; print(" ".join(sorted(sys.modules)))' % module
+    result = subprocess.run([ sys.executable, '-X', 'importtime', '-c', code ], cwd = kPACKAGE_PATH, capture_output = True, text = True, check = True)
+    children = { }
+
+    # > Imports are listed depth first, each module after the modules it imports, nesting being shown by the indentation.
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+
+        if depth == 1:
+            children[name.strip()] = int(cumulative_us)
+        elif depth == 0:
+            if name.strip() == module:
+                return (int(cumulative_us), children, set(result.stdout.split()))
+
+            children = { }
+
+    return (0, { }, set(result.stdout.split()))
+
+
+
+############################################################################################
+# Main
+
+# Parse arguments.
+parser = argparse.ArgumentParser(prog = 'import_benchmark.py')
+
+parser.add_argument('--runs', type = int, default = 5, help = 'number of measures (default: 5)')
+parser.add_argument('--module', default = 'tootbotlib.main', help = 'module to import (default: tootbotlib.main)')
+parser.add_argument('--top', type = int, default = 10, help = 'number of slowest modules to report (default: 10)')
+parser.add_argument('--max-ms', type = float, default = None, help = 'fail if the median import time exceeds this budget, in milliseconds')
+
+args = parser.parse_args()
+
+
+# Measure.
+totals = []
+modules_times = { }
+
+for run_nbr in range(args.runs):
+    total_us, children, modules = measure_import(args.module)
+    totals.append(total_us / 1000)
+
+    for name, cumulative_us in children.items():
+        modules_times.setdefault(name, []).append(cumulative_us / 1000)
+
+total = statistics.median(totals)
+
+print('import %s: %.1f ms (median of %s runs, min %.1f ms, max %.1f ms)' % (args.module, total, args.runs, min(totals), max(totals)))
+
+
+# Report the slowest modules imported directly, the cumulative time including their own imports.
+# Note: modules already imported by the interpreter startup (`site`) are not listed.
+print('slowest imports:')
+
+top_modules = { name: statistics.median(values) for name, values in modules_times.items() }
+
+for name, cumulative_ms in sorted(top_modules.items(), key = lambda item: -item[1])[:args.top]:
+    print('  %8.1f ms  %s' % (cumulative_ms, name))
+
+
+# Check lazy modules, and budget.
+failed = False
+eager_modules = [ name for name in kLAZY_MODULES if name in modules ]
+
+if len(eager_modules) > 0:
+    print('imported at startup, but should be lazy:', ', '.join(eager_modules))
+    failed = True
+
+if args.max_ms is not None and total > args.max_ms:
+    print('over budget: %.1f ms > %.1f ms' % (total, args.max_ms))
+    failed = True
+
+sys.exit(1 if failed else 0)
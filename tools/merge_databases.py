@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+
+# Merge per account databases ("<twitter_account>/tootbot.db") into a database shared by all accounts (see `--database`).
+# Rows already in the shared database are not copied twice, so it can be run again safely, e.g. after adding accounts.
+# Note: account databases are left untouched, run tootbot once on each of them before, so their schema is up to date.
+
+import argparse
+import sqlite3
+from pathlib import Path
+
+
+############################################################################################
+# Configuration
+
+# Tables to merge, and the columns identifying a row.
+kTABLES = {
+    'tweets': ('tweet_id', 'twitter_account', 'mastodon_login', 'mastodon_instance'),
+    'retries': ('tweet_id', 'twitter_account', 'mastodon_login', 'mastodon_instance'),
+    'watermarks': ('twitter_account', 'mastodon_login', 'mastodon_instance'),
+    'polls': ('twitter_account', 'mastodon_login', 'mastodon_instance'),
+    'backfills': ('twitter_account', 'mastodon_login', 'mastodon_instance'),
+    'fingerprints': ('fingerprint', 'tweet_id', 'twitter_account', 'mastodon_login', 'mastodon_instance')
+    }
+
+
+
+############################################################################################
+# Main
+
+# Parse arguments.
+parser = argparse.ArgumentParser(prog = 'merge_databases.py')
+
+parser.add_argument('database', type = Path, help = 'shared database to merge into (created if needed)')
+parser.add_argument('account_databases', type = Path, nargs = '*', help = 'account databases to merge (default: "*/tootbot.db")')
+
+args = parser.parse_args()
+
+account_databases = args.account_databases or sorted(Path().glob('*/tootbot.db'))
+
+
+# Open shared database.
+sql = sqlite3.connect(args.database, timeout = 60)
+db = sql.cursor()
+
+
+# Merge databases.
+for account_database in account_databases:
+    if account_database.resolve() == args.database.resolve():
+        continue
+
+    print(account_database, end = ': ')
+
+    db.execute('ATTACH DATABASE ? AS account', (str(account_database),))
+    db.execute('SAVEPOINT merge_account')
+
+    try:
+        # > Check schema.
+        columns = { row[1] for row in db.execute('PRAGMA account.table_info(tweets)') }
+
+        if not set(kTABLES['tweets']).issubset(columns):
+            raise Exception('outdated schema, run tootbot on this account first')
+
+        # > Create missing tables and indexes with the account database schema.
+        # >> Tables are created before indexes, and new databases get the incremental vacuum of tootbot.
+        if len(list(db.execute("SELECT 1 FROM main.sqlite_master WHERE type = 'table'"))) == 0:
+            db.execute('PRAGMA main.auto_vacuum = INCREMENTAL')
+
+        for (kind, name, statement) in list(db.execute("SELECT type, name, sql FROM account.sqlite_master WHERE type IN ('table', 'index') AND sql IS NOT NULL ORDER BY type DESC")):  # noqa
+            if len(list(db.execute('SELECT 1 FROM main.sqlite_master WHERE type = ? AND name = ?', (kind, name)))) == 0:
+                db.execute(statement)
+
+        # > Copy rows which are not already there.
+        counts = []
+
+        for table, keys in kTABLES.items():
+            if len(list(db.execute("SELECT 1 FROM account.sqlite_master WHERE type = 'table' AND name = ?", (table,)))) == 0:
+                continue
+
+            table_columns = ', '.join(row[1] for row in db.execute('PRAGMA account.table_info(%s)' % table))
+            match = ' AND '.join('m.%s IS a.%s' % (key, key) for key in keys)
+
+            db.execute('INSERT INTO main.%s (%s) SELECT %s FROM account.%s a WHERE NOT EXISTS (SELECT 1 FROM main.%s m WHERE %s) ORDER BY a.rowid' %
+                       (table, table_columns, table_columns, table, table, match))
+
+            counts.append('%s %s' % (db.rowcount, table))
+
+        db.execute('RELEASE SAVEPOINT merge_account')
+        sql.commit()
+
+        print('merged', ', '.join(counts))
+
+    except Exception as e:
+        db.execute('ROLLBACK TO SAVEPOINT merge_account')
+        db.execute('RELEASE SAVEPOINT merge_account')
+
+        print('cannot merge -', e)
+
+    db.execute('DETACH DATABASE account')
+
+sql.close()
@@ -0,0 +1,4 @@
+# Tootbot: replicate tweets on Mastodon accounts.
+#
+# Modules are split by stage, so each run only imports what it needs: a run without new tweets doesn't import
+#   Mastodon.py, requests, or the medias code (see `main` and tools/import_benchmark.py).
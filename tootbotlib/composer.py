@@ -0,0 +1,544 @@
+# Compose the toots of tweets: process the tweets (filters, quoted tweets, links), fetch their medias, and rewrite them for
+#   each Mastodon destination.
+# Note: only the light modules are imported here, the network and medias stages are imported by the methods using them.
+
+import re
+import html
+import time
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+from .utils import safe_int, safe_replace, toot_fingerprint
+from .metrics import metrics
+from .store import content_hash
+from .twitter import fetch_tweet
+
+
+# The stages of a run turning tweets into toots, with the state they share, so they don't depend on the command line.
+# Note: with `--pipeline`, tweets are processed and toots composed concurrently, so nothing here accesses the database:
+#   recent fingerprints are checked with `fingerprint_is_recent(destination, fingerprint)`, provided by the run.
+class TootsComposer:
+
+    def __init__(self, twitter_account, account_path, footer_tags, hosts_scheduler, unredir_policy, stages, resolver = 'head',
+                 medias_store = None, replayed_tweets = None, fingerprint_is_recent = None):
+        self.twitter_account = twitter_account
+        self.account_path = account_path
+        self.footer_tags = footer_tags
+        self.hosts_scheduler = hosts_scheduler
+        self.unredir_policy = unredir_policy
+        self.stages = stages
+        self.resolver = resolver
+        self.medias_store = medias_store
+        self.replayed_tweets = replayed_tweets
+        self.fingerprint_is_recent = fingerprint_is_recent if fingerprint_is_recent is not None else lambda destination, fingerprint: False
+
+
+    # Process the destination independent part of a tweet: filter it, fetch its quoted tweet, and resolve its links.
+    # Return a dictionary used by `compose_toot()`, or the outcome code (negative 'toot_id') if the tweet has to be skipped.
+    # Note: with `--pipeline`, it runs concurrently for several tweets, so it must not access the database.
+    def process_tweet(self, tweet, log):
+        from .links import unredir, unredir_get
+
+        tweet_id = safe_int(tweet['id'])
+        tweet_username = tweet['username']
+        tweet_content_raw =  tweet['tweet']
+        tweet_content = html.unescape(tweet_content_raw)
+
+
+        # Log.
+        log('--- ', str(tweet_id))
+        log('content: "', tweet_content, '"')
+
+
+        # We don't want to toot twitter replies (too much noise).
+        # Note: some reply-to are badly detected by Twint, so we also match tweet starting with a twitter handle.
+        if ('reply_to' in tweet and len(tweet['reply_to']) > 0) or re.match(r'^@[a-zA-Z0-9_]{1,15}($|[^a-zA-Z0-9_@])', tweet_content) != None:
+            log('tweet skipped: it\'s a reply')
+            return -2
+
+
+        # Handle bogus RTs. They start with 'RT @username: '.
+        bogus_rt_unrecoverable = re.match(r'^RT\s+@[^:]+:\s.*…', tweet_content, flags = re.DOTALL | re.IGNORECASE)
+        bogus_rt_recoverable = re.match(r'^(RT\s+@([^:]+):\s).*', tweet_content, flags = re.DOTALL | re.IGNORECASE)
+
+        if bogus_rt_unrecoverable is not None:
+            log('tweet skipped: bogus reweet')
+            return -3
+        elif bogus_rt_recoverable is not None:
+            # > Fix username, as a non-bogus RT.
+            tweet_username = bogus_rt_recoverable.group(2)
+
+            # > Remove the RT part in the content.`
+            span = bogus_rt_recoverable.span(1)
+            tweet_content = tweet_content[:span[0]] + tweet_content[span[1]:]
+
+            # > Log.
+            log('bogus retweet recovered: "', tweet_content, '"')
+
+
+        # Fetch quoted tweet.
+        quote_url = None
+        quoted_content = None
+        quoted_tweet_images = None
+
+        if 'quote_url' in tweet and tweet['quote_url'] != '':
+            quote_url = tweet['quote_url']
+
+            log('handle quoted tweet "', quote_url, '"')
+
+            try:
+                # > Fetch quoted tweet.
+                with self.stages['fetch'], self.hosts_scheduler.request('twitter.com', log) if self.replayed_tweets is None else nullcontext(), metrics.timer('tootbot_fetch_seconds', kind = 'quote'):
+                    fetch_result = fetch_tweet(quote_url, self.account_path, self.replayed_tweets)
+                quoted_twitter_username = fetch_result[0]
+                quoted_tweet = fetch_result[2]
+
+                # > Generate quoted content.
+                if quoted_tweet is None or 'tweet' not in quoted_tweet:
+                    log('failed to fetch quoted tweet "', quote_url, '"')
+                    quoted_content = ('@%s@twitter.com\n\n%s' % (quoted_twitter_username, quote_url))
+                else:
+                    quoted_tweet_content_raw = quoted_tweet['tweet']
+                    quoted_tweet_content = html.unescape(quoted_tweet_content_raw)
+
+                    quoted_content = ('@%s@twitter.com\n\n%s' % (quoted_twitter_username, quoted_tweet_content))
+
+                    if 'photos' in quoted_tweet:
+                        quoted_tweet_images = quoted_tweet['photos']
+
+            except Exception as e:
+                log('invalid quote url "', quote_url, '" - ', e)
+                quoted_content = quote_url
+
+
+        # Resolve all links once, for all destinations. Note: '\xa0' is unicode whitespace.
+        links = re.findall(r'https?://[^\s\xa0]+', '\n'.join([ tweet_content, quoted_content or '', quote_url or '' ]))
+
+        if 'photos' in tweet:
+            links = links + tweet['photos']
+
+        if quoted_tweet_images is not None:
+            links = links + quoted_tweet_images
+
+        resolved_links = { }
+
+        for link in links:
+            if link not in resolved_links:
+                with self.stages['resolve'], metrics.timer('tootbot_unredir_seconds'):
+                    resolved_links[link] = (unredir_get if self.resolver == 'get' else unredir)(link, self.unredir_policy, self.hosts_scheduler)
+
+
+        return {
+            'tweet': tweet,
+            'tweet_id': tweet_id,
+            'tweet_conversation_id': safe_int(tweet['conversation_id']),
+            'tweet_username': tweet_username,
+            'tweet_content': tweet_content,
+            'quote_url': quote_url,
+            'quoted_content': quoted_content,
+            'quoted_tweet_images': quoted_tweet_images,
+            'resolved_links': resolved_links
+            }
+
+
+    # Download a video, once for all the destinations with the same size limit, or find it in the medias store.
+    # Return `(path, content_type, content_hash)`.
+    def fetch_video(self, medias, tweet_id, dir_link, max_video_size, log):
+        from .media import download_video, recompress_video
+
+        key = ('video', dir_link, max_video_size)
+
+        # > Download, then recompress if needed.
+        def download():
+            video_path = self.account_path.joinpath('video-%s-%s.mp4' % (tweet_id, len(medias)))
+
+            log('download video "', dir_link, '"')
+
+            with self.stages['download'], metrics.timer('tootbot_media_seconds', kind = 'video', step = 'download'):
+                download_video(dir_link, video_path, max_video_size, log, self.hosts_scheduler)
+
+            with metrics.timer('tootbot_media_seconds', kind = 'video', step = 'recompress'):
+                recompress_video(video_path, max_video_size, log)
+
+            return (video_path, 'video/mp4')
+
+        if key not in medias:
+            try:
+                if self.medias_store is None:
+                    video_path, content_type = download()
+                    medias[key] = (video_path, content_type, content_hash(video_path))
+                else:
+                    medias[key] = self.medias_store.fetch(key, download, log)
+            except Exception as e:
+                medias[key] = e
+
+        if isinstance(medias[key], Exception):
+            raise medias[key]
+
+        return medias[key]
+
+    # Download a photo, once for all the destinations, or find it in the medias store.
+    # Return `(content, content_type, content_hash)`, or None.
+    def fetch_photo(self, medias, dir_link, log):
+        import requests
+
+        key = ('photo', dir_link)
+
+        if key in medias:
+            return medias[key]
+
+        # > Download, respecting the host limits.
+        def get(url):
+            host = urlsplit(url)[1]
+
+            with self.stages['download'], self.hosts_scheduler.request(host, log), metrics.timer('tootbot_media_seconds', kind = 'photo', step = 'download'):
+                media = requests.get(url)
+
+            if media.status_code == 429:
+                self.hosts_scheduler.backoff(host, media.headers.get('Retry-After'), log)
+
+            return media
+
+        def download():
+            media = None
+
+            # > Try by passing by nitter.
+            if media is None or media.ok == False:
+                log('try to download photo "', dir_link, '" via nitter')
+
+                try:
+                    media = get(dir_link.replace('https://pbs.twimg.com/', 'https://nitter.net/pic/orig/'))
+                except Exception as e:
+                    log('failed to download the photo via nitter - ', e)
+
+            # > Try by using the original link.
+            if media is None or media.ok == False:
+                log('try to download photo "', dir_link, '" directly')
+
+                try:
+                    media = get(dir_link)
+                except Exception as e:
+                    log('failed to download the photo via original url - ', e)
+
+            if media is None or media.ok == False:
+                return None
+
+            return (media.content, media.headers.get('content-type'))
+
+        # > Keep the photo content in memory, for all the destinations.
+        if self.medias_store is None:
+            photo = download()
+            photo = None if photo is None else (*photo, content_hash(photo[0]))
+        else:
+            try:
+                photo = self.medias_store.fetch(key, download, log)
+            except Exception as e:
+                log('cannot store photo - ', e)
+                photo = None
+
+            if photo is not None:
+                with open(photo[0], 'rb') as file:
+                    photo = (file.read(), photo[1], photo[2])
+
+        medias[key] = photo
+
+        return photo
+
+
+    # Compose the toot of a processed tweet for a destination: rewrite its content for the destination limits, and upload its medias.
+    # Return the toot to post, or the outcome code (negative 'toot_id') if the tweet has to be skipped.
+    def compose_toot(self, destination, processed, medias, log):
+        from .posting import mastodon_media_post
+
+        tweet = processed['tweet']
+        tweet_id = processed['tweet_id']
+        tweet_username = processed['tweet_username']
+        tweet_content = processed['tweet_content']
+        quote_url = processed['quote_url']
+        mastodon_max_characters = destination.mastodon_max_characters
+        mastodon_max_media_attachments = destination.mastodon_max_media_attachments
+
+        toot_photos_ids = []
+        toot_videos_ids = []
+        toot_medias = []
+        toot_medias_hashes = []
+        medias_uploaded_at = 0
+
+
+        # Check basic tweet content size.
+        if len(tweet_content) > mastodon_max_characters:
+            log('tweet skipped - too long ', len(tweet_content), ' > ', mastodon_max_characters)
+            return -1
+
+
+        # Handle retweet.
+        if self.twitter_account and tweet_username.lower() != self.twitter_account.lower():
+            new_tweet_content = ('🔄 @%s@twitter.com\n\n%s' % (tweet_username, tweet_content))
+
+            if len(new_tweet_content) > mastodon_max_characters:
+                log('retweet skipped - toot too long ', len(new_tweet_content), ' > ', mastodon_max_characters)
+                return -4
+            else:
+                tweet_content = new_tweet_content            
+
+
+        # Handle quoted tweet.
+        # Note: a quoted tweet can be retweeted.
+        if quote_url is not None:
+
+            # > Generate tweet content.
+            def create_quote_tweet(content):
+                return tweet_content + ('\n\n———\n🔄 %s' % content)
+
+            new_tweet_content = create_quote_tweet(processed['quoted_content'])
+
+            if len(new_tweet_content) > mastodon_max_characters:
+                log('toot too long with this quote, use reduced format')
+                new_tweet_content = create_quote_tweet(quote_url)
+
+            if len(new_tweet_content) > mastodon_max_characters:
+                log('toot still too long with reduced format, skip')
+                return -5
+
+            tweet_content = new_tweet_content
+
+
+        # Gather all links. Note: '\xa0' is unicode whitespace.
+        links = re.findall(r'https?://[^\s\xa0]+', tweet_content)
+
+        if 'photos' in tweet:
+            links = links + tweet['photos']
+
+        if processed['quoted_tweet_images'] is not None:
+            links = links + processed['quoted_tweet_images']
+
+
+        # Handle links.
+        handled_links = set()
+
+        for link in links:
+
+            # > Resolved link.
+            dir_link = processed['resolved_links'].get(link, link)
+
+            # > Check it wasn't already handled.
+            if dir_link in handled_links:
+                continue
+
+            handled_links.add(dir_link)
+
+            # > Check if we reached limits.
+            if len(toot_medias) > mastodon_max_media_attachments:
+                log('skip link "', link, '" -> "', dir_link, '" - limit of ', mastodon_max_media_attachments, ' medias reached')
+                tweet_content = safe_replace(tweet_content, link, dir_link, mastodon_max_characters, log)
+                continue
+
+            # > Log.
+            log('handle link "', link, '" -> "', dir_link, '"')
+
+            # > Handle '/photo/' and '/video/' link as video.
+            # > The gif animations are encoded as video, and stay under the '/photo/' path. If it's a real photo, it will just fail.
+            is_photo_link = (re.search(r'twitter.com/.*/photo/', dir_link) is not None)
+            is_video_link = (re.search(r'twitter.com/.*/video/', dir_link) is not None)
+
+            if is_photo_link or is_video_link:
+
+                # > We consider that photos are in `tweet['photos']` with real link (different than this one), and so can be removed
+                # >   from the the tweet content in all cases (succes or error).
+                # > If we fail to upload the photo on next stage, the photo will be lost, but it's better than keeping the photo
+                # >   *and* the link to it.
+                if is_photo_link:
+                    tweet_content = tweet_content.replace(link, '')
+                    tweet_content = tweet_content.replace(dir_link, '')
+
+                # Check that Mastodon server accept mp4 video.
+                if 'video/mp4' not in destination.mastodon_supported_mime_type:
+                    log('skip video "', dir_link, '": server doesn\'t support this type of video')
+                    continue
+
+                # Download from Twitter, to be uploaded to Mastodon once the toot is known not to be a duplicate.
+                try:
+                    # > Download the video.
+                    video_path, _, video_hash = self.fetch_video(medias, tweet_id, dir_link, destination.mastodon_video_size_limit, log)
+
+                    # > Read video content.
+                    file = open(video_path, "rb")
+                    video_data = file.read()
+                    file.close()
+
+                    # > Check result size.
+                    if len(video_data) > destination.mastodon_video_size_limit:
+                        log('skip video - too big ', len(video_data), ' > ', destination.mastodon_video_size_limit)
+                        continue
+
+                    # > Store the video.
+                    toot_medias.append(('video', video_data, 'video/mp4', dir_link if is_video_link else None))
+                    toot_medias_hashes.append(video_hash)
+
+                    # > Remove the links to the video from the tweet content (restored if its upload fails).
+                    if is_video_link:
+                        tweet_content = tweet_content.replace(link, '')
+                        tweet_content = tweet_content.replace(dir_link, '')
+
+                    # > Next link.
+                    continue
+
+                except Exception as e:
+                    log('cannot download video - ', e)
+
+            # > Handle 'pbs.twimg.com'
+            if 'https://pbs.twimg.com/' in dir_link:
+
+                # > Skip video thumbnails. Video are completely attached in previous section.
+                if '/tweet_video_thumb/' in dir_link:
+                    log('skip thumbnail photo "', dir_link, '"')
+                    continue
+
+                # > Download.
+                photo = self.fetch_photo(medias, dir_link, log)
+
+                # > Store.
+                if photo is not None:
+                    try:
+                        # > Check that Mastodon server accept this kind of photo.
+                        content, content_type, photo_hash = photo
+
+                        if content_type.lower() not in destination.mastodon_supported_mime_type:
+                            log('skip photo "', dir_link, '": server doesn\'t support ', content_type, ' media')
+                            continue
+
+                        # > Check the size is okay.
+                        if len(content) > destination.mastodon_image_size_limit:
+                            log('skip photo - too big ', len(content), ' > ', destination.mastodon_image_size_limit)
+
+                        # > Store the photo.
+                        toot_medias.append(('photo', content, content_type, dir_link))
+                        toot_medias_hashes.append(photo_hash)
+
+                        # > Remove the links to the photo from the tweet content (restored if its upload fails).
+                        tweet_content = tweet_content.replace(link, '')
+                        tweet_content = tweet_content.replace(dir_link, '')
+
+                        # > Next link.
+                        continue
+
+                    except Exception as e:
+                        log('cannot handle photo - ', e)
+
+            # > Fallback: Handle other links.
+            tweet_content = safe_replace(tweet_content, link, dir_link, mastodon_max_characters, log)
+
+
+        # Remove ellipsis
+        #tweet_content = tweet_content.replace('\xa0…', ' ')
+
+        #c = c.replace('  ', '\n').replace('. ', '.\n')
+
+
+        # Replace links to twitter by nitter ones.
+        tweet_content = safe_replace(tweet_content, '/twitter.com/', '/nitter.net/', mastodon_max_characters, log)
+
+
+        # Replace Twitter handles by Mastodon style handle:
+        # - Avoid Twitter handles which may reference unrelated Mastodon users.
+        # - Some Mastodon clients recognize these handles, and will create a link to Twitter.
+        #
+        # Note: we can't use re.sub: we need to skip entries which are already Mastodon
+        #  handles (if someone Tweet a Mastodon handle for example), so we need to match
+        #  a 'separator' caracter before and after Twitter handle, but doing so
+        #  will make re.sub to don't see 2 handles separated by this separator (a space, for example).
+        new_tweet_content = tweet_content
+
+        while True:
+            match = re.search(r'(^|[^a-zA-Z0-9_@])(@[a-zA-Z0-9_]{1,15})($|[^a-zA-Z0-9_@])', new_tweet_content)
+
+            if match is None:
+                break
+
+            span1 = match.span(1) # First 'separator' group.
+            span2 = match.span(3) # Second 'separator' group.
+
+            #               ... (^|[...])]           + Twitter handle + @twitter.com   + [($|[...]) ...
+            new_tweet_content = new_tweet_content[:span1[1]] + match.group(2) + '@twitter.com' + new_tweet_content[span2[0]:]
+
+        if len(new_tweet_content) > mastodon_max_characters:
+            log('replaced handles are too long, use original handles')
+        else:
+            tweet_content = new_tweet_content
+
+
+        # Replace utm_? tracking.
+        new_tweet_content = re.sub('\?utm.*$', '?utm_medium=Social&utm_source=Mastodon', tweet_content)
+
+        if len(new_tweet_content) > mastodon_max_characters:
+            log('replaced utm tracking is too long, use original utm')
+        else:
+            tweet_content = new_tweet_content
+
+
+        # Fingerprint the toot, before the footer tags of the account (see `--skip-duplicates`).
+        fingerprint = toot_fingerprint(tweet_content, toot_medias_hashes)
+
+
+        # Skip duplicates of toots posted recently, before uploading their medias.
+        # Note: toots composed concurrently are only checked when posted (see `toot_is_duplicate()`).
+        if self.fingerprint_is_recent(destination, fingerprint):
+            log('tweet skipped - the same toot has been posted recently')
+            return -7
+
+
+        # Upload medias. The link of a media which can't be uploaded is put back, so it isn't lost.
+        for kind, data, content_type, restored_link in toot_medias:
+            try:
+                log('upload ', kind, ' to Mastodon server')
+
+                with self.stages['upload'], metrics.timer('tootbot_media_seconds', kind = kind, step = 'upload'):
+                    media_id = mastodon_media_post(destination.mastodon_api, data, content_type, log, destination.rate_limiter)
+
+                medias_uploaded_at = time.monotonic()
+
+                metrics.inc('tootbot_uploaded_bytes_total', len(data), kind = kind)
+
+                log('uploaded ', kind, ' - media-id: ', media_id)
+
+                # > Store media id.
+                (toot_videos_ids if kind == 'video' else toot_photos_ids).append(media_id)
+
+            except Exception as e:
+                log('cannot upload ', kind, ' - ', e)
+
+                if restored_link is not None:
+                    restored_link = restored_link.replace('/twitter.com/', '/nitter.net/')
+
+                    if len(tweet_content) + 1 + len(restored_link) <= mastodon_max_characters:
+                        tweet_content = tweet_content + '\n' + restored_link
+
+
+        # Add footer tags.
+        if self.footer_tags:
+            new_tweet_content = tweet_content + '\n' + self.footer_tags
+
+            if len(new_tweet_content) > mastodon_max_characters:
+                log('footer tags are too long, skip them')
+            else:
+                tweet_content = new_tweet_content
+
+
+        # Check size.
+        if len(tweet_content) > mastodon_max_characters:
+            log('truncate toot, too long - ', len(tweet_content), ' > ', mastodon_max_characters)
+            tweet_content = tweet_content[:mastodon_max_characters]
+
+
+        # Toot.
+        return {
+            'tweet_id': tweet_id,
+            'tweet_conversation_id': processed['tweet_conversation_id'],
+            'tweet_created_at': tweet['created_at'],
+            'content': tweet_content,
+            'photos_ids': toot_photos_ids,
+            'videos_ids': toot_videos_ids,
+            'medias_uploaded_at': medias_uploaded_at,
+            'fingerprint': fingerprint,
+            'attempts': 0
+            }
@@ -0,0 +1,84 @@
+# Configuration.
+
+# App name.
+kAPP_NAME = 'tootbot'
+
+# Mastodon rate limits used until the server tells us its own: (requests, window in seconds).
+# Note: these are the Mastodon defaults, per IP for authenticated calls, per account, and for media uploads.
+kRATELIMIT_INSTANCE = (1500, 300)
+kRATELIMIT_ACCOUNT = (300, 300)
+kRATELIMIT_MEDIA = (30, 1800)
+
+# Longest wait for the rate limit before posting a toot or uploading a media (in seconds), toots being queued for later
+#   and medias skipped beyond it.
+kRATELIMIT_MAX_POST_WAIT = 30
+
+# Retry queue of toots which failed to post: maximum attempts, and exponential backoff delays (in seconds).
+kRETRY_MAX_ATTEMPTS = 8
+kRETRY_BASE_DELAY = 60
+kRETRY_MAX_DELAY = 4 * 3600
+
+# Links resolution policy learned per host (see `UnredirPolicy`): observations needed to skip 'https' on hosts where it
+#   always times out, or to stop resolving links of hosts which never redirect, and how long they are trusted (in seconds).
+kUNREDIR_HTTPS_TIMEOUTS = 2
+kUNREDIR_NO_REDIRECT_REQUESTS = 10
+kUNREDIR_POLICY_TTL = 30 * 86400
+
+# Links resolution with 'GET' requests (see `unredir_get()`): maximum bytes read from the last page to find
+#   an HTML or JavaScript redirection, and the 'User-Agent' sent.
+kUNREDIR_GET_MAX_BYTES = 8192
+kUNREDIR_GET_USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0'
+
+# Politeness limits of outgoing requests per host (see `HostsScheduler`): (concurrent requests, minimum interval between
+#   requests in seconds), shared by all the accounts running from the same directory. '*' applies to each other host.
+# Note: Mastodon instances are paced by their own rate limits (see `RateLimiter`).
+kHOSTS_LIMITS = {
+    't.co': (8, 0.05),
+    'twitter.com': (2, 1.0),        # Quoted tweets fetches (twint), and videos (yt-dlp).
+    'nitter.net': (2, 1.0),
+    'pbs.twimg.com': (4, 0.1),
+    'video.twimg.com': (2, 0.5),
+    '*': (4, 0)
+    }
+
+# Host wide backoff after a '429 Too Many Requests' without 'Retry-After', and maximum wait for a host before giving up (in seconds).
+kHOSTS_BACKOFF = 60
+kHOSTS_MAX_WAIT = 120
+
+# Lowest total bitrate (video and audio, in kbit/s) a video can be recompressed to. Videos which would need less to fit
+#   the Mastodon size limit are skipped before being downloaded.
+kVIDEO_MIN_BITRATE = 250
+
+# Twitter ids epoch (in milliseconds): tweet ids embed their creation time in their upper bits.
+kTWITTER_EPOCH = 1288834974657
+
+# Maximum concurrent calls of each network stage, when tweets are prepared concurrently (see `--pipeline`).
+kPIPELINE_STAGES = {
+    'fetch': 2,     # Quoted tweets fetches (twint).
+    'resolve': 8,   # Links resolutions.
+    'download': 2,  # Photos and videos downloads.
+    'upload': 2     # Medias uploads to Mastodon.
+    }
+
+# Adaptive polling (see `--adaptive-polling`): the last tweets of the account, within some days, give its posting rate,
+#   and the account is polled every `kPOLL_INTERVAL_RATIO` of the mean interval between its tweets, within bounds (in seconds).
+# Note: the jitter (share of the interval) spreads the polls of accounts started by the same cron invocation.
+kPOLL_RATE_TWEETS = 50
+kPOLL_RATE_DAYS = 30
+kPOLL_INTERVAL_RATIO = 0.25
+kPOLL_MIN_INTERVAL = 300
+kPOLL_MAX_INTERVAL = 6 * 3600
+kPOLL_JITTER = 0.2
+
+# Medias store (see `--medias-store`): how long downloaded medias are reused by other runs and accounts (in seconds), and
+#   number of lock files shared by the keys.
+kMEDIAS_STORE_TTL = 86400
+kMEDIAS_STORE_LOCKS = 64
+
+# Backfill (see `--backfill`): time window of tweets fetched and posted at once, pause between windows, and time after which
+#   a run stops backfilling, the next run resuming from the last window (in seconds). The last window is fetched again by
+#   the next run, as far back as the delay after which tweets are assumed to be indexed by the Twitter search.
+kBACKFILL_WINDOW = 86400
+kBACKFILL_PAUSE = 5
+kBACKFILL_RUN_SECONDS = 600
+kBACKFILL_INDEX_DELAY = 3600
@@ -0,0 +1,339 @@
+# Database of the processed tweets, the retry queue of toots, toots fingerprints, polls schedules and backfills
+#   checkpoints, for a Twitter account and its Mastodon destinations.
+
+import json
+import sqlite3
+
+from .utils import tweet_id_at
+
+
+# Rows are keyed by Twitter account and Mastodon destination, so a database can be shared by all accounts (see `--database`),
+#   and an account mirrored to several destinations by separate runs.
+# Note: writes are committed as soon as they are done (a toot fingerprint with its tweet), so a run stopping at any point
+#   doesn't post a toot twice.
+class Database:
+
+    def __init__(self, path, twitter_account, shared = False, incremental_vacuum = False, logger = None):
+        self.twitter_account = twitter_account
+
+        # Logger helper.
+        def llogger(*args):
+            if logger is not None:
+                logger(*args)
+
+        # > "Connect"
+        # >> Note: a shared database may be busy with other accounts runs.
+        sql = sqlite3.connect(path, timeout = 60)
+        db = sql.cursor()
+
+        self.sql = sql
+        self.db = db
+
+        # > Update column names.
+        columns = list(map(lambda x: x[1], db.execute('PRAGMA table_info(tweets)')))
+        old_columns = { 'tweet', 'toot', 'twitter', 'mastodon', 'instance' }
+
+        if len(columns) == 0:
+            llogger('configure new database')
+
+            # >> Incremental vacuum has to be enabled before the first table is created.
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('CREATE TABLE tweets (tweet_id INT, tweet_conversation_id INT, toot_id INT, twitter_account TEXT, mastodon_login TEXT, mastodon_instance TEXT)')
+
+        if set(columns) == old_columns:
+            llogger('update table columns names')
+
+            db.execute('SAVEPOINT rename_tweets_table') # No need to `ROLLBACK TO SAVEPOINT``: changes before `RELEASE` will be lost when we exit on error anyway.
+            db.execute('ALTER TABLE tweets RENAME COLUMN tweet TO tweet_id')
+            db.execute('ALTER TABLE tweets RENAME COLUMN toot TO toot_id')
+            db.execute('ALTER TABLE tweets RENAME COLUMN twitter TO twitter_account')
+            db.execute('ALTER TABLE tweets RENAME COLUMN mastodon TO mastodon_login')
+            db.execute('ALTER TABLE tweets RENAME COLUMN instance TO mastodon_instance')
+            db.execute('ALTER TABLE tweets ADD COLUMN tweet_conversation_id INT')
+            db.execute('RELEASE SAVEPOINT rename_tweets_table')
+            sql.commit()
+
+        # > Update column types.
+        columns = { }
+
+        for column in db.execute('PRAGMA table_info(tweets)'):
+            columns[column[1]] = column[2].lower()
+
+        if columns['tweet_id'] == 'text' or columns['toot_id'] == 'text' or columns['tweet_conversation_id'] == 'text':
+            llogger('update table columns types')
+
+            db.execute('SAVEPOINT retype_tweets_table')
+
+            if columns['tweet_id'] == 'text':
+                db.execute('ALTER TABLE tweets ADD COLUMN tweet_id_tmp INT')
+                db.execute('UPDATE tweets SET tweet_id_tmp = tweet_id')
+                db.execute('ALTER TABLE tweets DROP COLUMN tweet_id')
+                db.execute('ALTER TABLE tweets RENAME COLUMN tweet_id_tmp TO tweet_id')
+
+            if columns['toot_id'] == 'text':
+                db.execute('ALTER TABLE tweets ADD COLUMN toot_id_tmp INT')
+                db.execute('UPDATE tweets SET toot_id_tmp = toot_id')
+                db.execute('ALTER TABLE tweets DROP COLUMN toot_id')
+                db.execute('ALTER TABLE tweets RENAME COLUMN toot_id_tmp TO toot_id')
+
+            if columns['tweet_conversation_id'] == 'text':
+                db.execute('ALTER TABLE tweets ADD COLUMN tweet_conversation_id_tmp INT')
+                db.execute('UPDATE tweets SET tweet_conversation_id_tmp = tweet_conversation_id')
+                db.execute('ALTER TABLE tweets DROP COLUMN tweet_conversation_id')
+                db.execute('ALTER TABLE tweets RENAME COLUMN tweet_conversation_id_tmp TO tweet_conversation_id')
+
+            db.execute('RELEASE SAVEPOINT retype_tweets_table')
+            sql.commit()
+
+        # > Enable incremental vacuum on existing databases, so pruned pages are given back to the file system.
+        if incremental_vacuum and db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            llogger('enable incremental vacuum')
+
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('VACUUM')
+
+        # > Create tweets pruning watermarks: tweets older than them have been processed, even if they are not in the database anymore.
+        db.execute('CREATE TABLE IF NOT EXISTS watermarks (twitter_account TEXT, mastodon_login TEXT, mastodon_instance TEXT, pruned_before_id INT)')
+
+        # > Create retry queue.
+        db.execute('CREATE TABLE IF NOT EXISTS retries (tweet_id INT, tweet_conversation_id INT, tweet_created_at TEXT, toot_content TEXT, toot_photos_ids TEXT, toot_videos_ids TEXT, attempts INT, next_attempt_at INT, last_error TEXT, twitter_account TEXT, mastodon_login TEXT, mastodon_instance TEXT, toot_fingerprint TEXT)')  # noqa
+
+        if 'toot_fingerprint' not in [ column[1] for column in db.execute('PRAGMA table_info(retries)') ]:
+            db.execute('ALTER TABLE retries ADD COLUMN toot_fingerprint TEXT')
+
+        # > Create fingerprints of posted toots, to skip duplicates.
+        db.execute('CREATE TABLE IF NOT EXISTS fingerprints (fingerprint TEXT, posted_at INT, tweet_id INT, twitter_account TEXT, mastodon_login TEXT, mastodon_instance TEXT)')
+
+        # > Create polls schedule, per account and destination, so runs mirroring an account to other destinations keep their own.
+        db.execute('CREATE TABLE IF NOT EXISTS polls (twitter_account TEXT, polled_at INT, next_poll_at INT, mastodon_login TEXT, mastodon_instance TEXT)')
+
+        if 'mastodon_login' not in [ column[1] for column in db.execute('PRAGMA table_info(polls)') ]:
+            db.execute('ALTER TABLE polls ADD COLUMN mastodon_login TEXT')
+            db.execute('ALTER TABLE polls ADD COLUMN mastodon_instance TEXT')
+            db.execute('DELETE FROM polls')
+
+        # > Create backfills checkpoints, per account and destination.
+        db.execute('CREATE TABLE IF NOT EXISTS backfills (twitter_account TEXT, backfilled_until INT, mastodon_login TEXT, mastodon_instance TEXT)')
+
+        # >> Checkpoints of the account are dropped, backfills start again, skipping the tweets already processed.
+        if 'mastodon_login' not in [ column[1] for column in db.execute('PRAGMA table_info(backfills)') ]:
+            db.execute('ALTER TABLE backfills ADD COLUMN mastodon_login TEXT')
+            db.execute('ALTER TABLE backfills ADD COLUMN mastodon_instance TEXT')
+            db.execute('DELETE FROM backfills')
+
+        # > Create indexes, lookups are by tweet and by conversation, for a given account and destination.
+        db.execute('CREATE INDEX IF NOT EXISTS tweets_tweet_id ON tweets (tweet_id, twitter_account, mastodon_login, mastodon_instance)')
+        db.execute('CREATE INDEX IF NOT EXISTS tweets_tweet_conversation_id ON tweets (tweet_conversation_id, twitter_account, mastodon_login, mastodon_instance)')
+        db.execute('CREATE INDEX IF NOT EXISTS retries_tweet_id ON retries (tweet_id, twitter_account, mastodon_login, mastodon_instance)')
+        db.execute('CREATE INDEX IF NOT EXISTS retries_tweet_conversation_id ON retries (tweet_conversation_id, twitter_account, mastodon_login, mastodon_instance)')
+        db.execute('CREATE INDEX IF NOT EXISTS fingerprints_fingerprint ON fingerprints (fingerprint, mastodon_login, mastodon_instance)')
+        sql.commit()
+
+        # > Let runs of other accounts read a shared database while we write to it.
+        if shared:
+            db.execute('PRAGMA journal_mode = WAL')
+
+
+    # Keys of the rows of a destination.
+    def keys(self, destination):
+        return (self.twitter_account, destination.mastodon_login, destination.mastodon_instance)
+
+
+    # Processed tweets.
+    # > Mark a tweet as processed.
+    def mark_tweet_as_processed(self, destination, tweet_id, tweet_conversation_id, toot_id):
+        self.db.execute("INSERT INTO tweets (tweet_id, tweet_conversation_id, toot_id, twitter_account, mastodon_login, mastodon_instance) VALUES (?, ?, ?, ?, ?, ?)", (tweet_id, tweet_conversation_id, toot_id, *self.keys(destination)))  # noqa
+        self.sql.commit()
+
+    # > Check if a tweet has been processed.
+    def tweet_is_processed(self, destination, tweet_id):
+        self.db.execute('SELECT * FROM tweets WHERE tweet_id = ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ? LIMIT 1', (tweet_id, *self.keys(destination)))  # noqa
+
+        if self.db.fetchone() is not None:
+            return True
+
+        self.db.execute('SELECT 1 FROM watermarks WHERE pruned_before_id > ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ? LIMIT 1', (tweet_id, *self.keys(destination)))  # noqa
+
+        return self.db.fetchone() is not None
+
+    # > Find the toot to reply to in a conversation: the toot of its last processed tweet, if it has been posted. Return None otherwise.
+    def find_reply_to_id(self, destination, tweet_conversation_id):
+        if tweet_conversation_id is None:
+            return None
+
+        self.db.execute('SELECT toot_id FROM tweets WHERE tweet_conversation_id = ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ? ORDER BY rowid DESC LIMIT 1', (tweet_conversation_id, *self.keys(destination)))  # noqa
+        last_tweet = self.db.fetchone()
+
+        if last_tweet is not None and last_tweet[0] > 0:
+            return last_tweet[0]
+
+        return None
+
+    # > Ids of the tweets of the account since a tweet id, processed or queued, for all destinations.
+    def recent_tweets_ids(self, since_tweet_id):
+        self.db.execute('SELECT tweet_id FROM tweets WHERE twitter_account = ? and tweet_id >= ? UNION SELECT tweet_id FROM retries WHERE twitter_account = ? and tweet_id >= ?', (self.twitter_account, since_tweet_id, self.twitter_account, since_tweet_id))  # noqa
+
+        return { row[0] for row in self.db.fetchall() }
+
+    # > Forget tweets older than some days, except the last one of conversations which got a toot recently enough to be replied to.
+    # > Return the number of forgotten tweets.
+    # > Note: the last toot of a thread (its last tweet being a reply) is kept `prune_conversation_days`, so we can still reply to it.
+    # > Note: tweets after `kept_after` (a timestamp) are kept, and not marked as processed by the watermark, e.g. the part of
+    # >   the account timeline a backfill in progress didn't reach yet.
+    def prune_tweets(self, destination, now, prune_days, prune_conversation_days, kept_after = None):
+        pruned_before_id = tweet_id_at(now - prune_days * 86400 if kept_after is None else min(now - prune_days * 86400, kept_after))
+        conversation_before_id = tweet_id_at(now - max(prune_days, prune_conversation_days) * 86400)
+        keys = self.keys(destination)
+
+        self.db.execute('SAVEPOINT prune_tweets')
+
+        self.db.execute('DELETE FROM tweets WHERE tweet_id < ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ? AND rowid NOT IN ('  # noqa
+                        'SELECT MAX(rowid) FROM tweets WHERE tweet_conversation_id IS NOT NULL AND toot_id > 0 AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ? '  # noqa
+                        'GROUP BY tweet_conversation_id HAVING MAX(tweet_id) >= ? AND MAX(tweet_id) != tweet_conversation_id)', (pruned_before_id, *keys, *keys, conversation_before_id))  # noqa
+        pruned_count = self.db.rowcount
+
+        self.db.execute('UPDATE watermarks SET pruned_before_id = MAX(pruned_before_id, ?) WHERE twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', (pruned_before_id, *keys))  # noqa
+
+        if self.db.rowcount == 0:
+            self.db.execute('INSERT INTO watermarks (twitter_account, mastodon_login, mastodon_instance, pruned_before_id) VALUES (?, ?, ?, ?)', (*keys, pruned_before_id))  # noqa
+
+        self.db.execute('RELEASE SAVEPOINT prune_tweets')
+        self.sql.commit()
+
+        return pruned_count
+
+    # > Give pages freed by pruning back to the file system.
+    def incremental_vacuum(self):
+        self.db.execute('PRAGMA incremental_vacuum')
+        self.db.fetchall()
+        self.sql.commit()
+
+
+    # Retry queue.
+    # > Check if a tweet is waiting in the retry queue.
+    def tweet_is_queued(self, destination, tweet_id):
+        self.db.execute('SELECT 1 FROM retries WHERE tweet_id = ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ? LIMIT 1', (tweet_id, *self.keys(destination)))  # noqa
+
+        return self.db.fetchone() is not None
+
+    # > Check if a conversation has toots waiting in the retry queue. Next toots of this conversation have to wait behind them.
+    def conversation_is_queued(self, destination, tweet_conversation_id):
+        if tweet_conversation_id is None:
+            return False
+
+        self.db.execute('SELECT 1 FROM retries WHERE tweet_conversation_id = ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ? LIMIT 1', (tweet_conversation_id, *self.keys(destination)))  # noqa
+
+        return self.db.fetchone() is not None
+
+    # > Add a toot to the retry queue, or update its entry.
+    def queue_toot(self, destination, toot, attempts, next_attempt_at, last_error):
+        self.db.execute('UPDATE retries SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE tweet_id = ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', (attempts, next_attempt_at, last_error, toot['tweet_id'], *self.keys(destination)))  # noqa
+
+        if self.db.rowcount == 0:
+            self.db.execute('INSERT INTO retries (tweet_id, tweet_conversation_id, tweet_created_at, toot_content, toot_photos_ids, toot_videos_ids, attempts, next_attempt_at, last_error, twitter_account, mastodon_login, mastodon_instance, toot_fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',  # noqa
+                            (toot['tweet_id'], toot['tweet_conversation_id'], toot['tweet_created_at'], toot['content'], json.dumps(toot['photos_ids']), json.dumps(toot['videos_ids']), attempts, next_attempt_at, last_error, *self.keys(destination), toot.get('fingerprint')))  # noqa
+
+        self.sql.commit()
+
+    # > Remove a toot from the retry queue.
+    def unqueue_toot(self, destination, toot):
+        self.db.execute('DELETE FROM retries WHERE tweet_id = ? AND twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', (toot['tweet_id'], *self.keys(destination)))  # noqa
+        self.sql.commit()
+
+    # > Check if toots of the account, for any destination, are due to be retried.
+    def has_due_toots(self, now):
+        self.db.execute('SELECT 1 FROM retries WHERE twitter_account = ? and next_attempt_at <= ? LIMIT 1', (self.twitter_account, now))
+
+        return self.db.fetchone() is not None
+
+    # > Toots queued for a destination, oldest first. Return a list of `(toot, next_attempt_at)`.
+    def queued_toots(self, destination):
+        self.db.execute('SELECT tweet_id, tweet_conversation_id, tweet_created_at, toot_content, toot_photos_ids, toot_videos_ids, attempts, next_attempt_at, toot_fingerprint FROM retries WHERE twitter_account = ? and mastodon_login = ? and mastodon_instance = ? ORDER BY rowid', self.keys(destination))  # noqa
+
+        return [ ({
+            'tweet_id': queued_row[0],
+            'tweet_conversation_id': queued_row[1],
+            'tweet_created_at': queued_row[2],
+            'content': queued_row[3],
+            'photos_ids': json.loads(queued_row[4]),
+            'videos_ids': json.loads(queued_row[5]),
+            'medias_uploaded_at': 0,
+            'fingerprint': queued_row[8],
+            'attempts': queued_row[6]
+            }, queued_row[7]) for queued_row in self.db.fetchall() ]
+
+    # > Number of toots queued for a destination.
+    def queued_count(self, destination):
+        self.db.execute('SELECT COUNT(*) FROM retries WHERE twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', self.keys(destination))
+
+        return self.db.fetchone()[0]
+
+
+    # Fingerprints of posted toots (see `--skip-duplicates`).
+    # > Check if a destination posted a toot since a time, or has it in its retry queue.
+    def fingerprint_is_known(self, destination, fingerprint, since):
+        self.db.execute('SELECT 1 FROM fingerprints WHERE fingerprint = ? AND mastodon_login = ? and mastodon_instance = ? AND posted_at >= ? LIMIT 1', (fingerprint, destination.mastodon_login, destination.mastodon_instance, since))  # noqa
+
+        if self.db.fetchone() is not None:
+            return True
+
+        self.db.execute('SELECT 1 FROM retries WHERE toot_fingerprint = ? AND mastodon_login = ? and mastodon_instance = ? LIMIT 1', (fingerprint, destination.mastodon_login, destination.mastodon_instance))  # noqa
+
+        return self.db.fetchone() is not None
+
+    # > Fingerprints posted since a time, or in the retry queues, for all destinations. Return a set of `(mastodon_login, mastodon_instance, fingerprint)`.
+    def known_fingerprints(self, since):
+        self.db.execute('SELECT mastodon_login, mastodon_instance, fingerprint FROM fingerprints WHERE posted_at >= ?', (since,))
+        fingerprints = set(self.db.fetchall())
+
+        self.db.execute('SELECT mastodon_login, mastodon_instance, toot_fingerprint FROM retries WHERE toot_fingerprint IS NOT NULL')
+        fingerprints.update(self.db.fetchall())
+
+        return fingerprints
+
+    # > Remember the fingerprint of a posted toot.
+    # > Note: it's committed with the tweet marked as processed.
+    def remember_fingerprint(self, destination, tweet_id, fingerprint, posted_at):
+        self.db.execute('INSERT INTO fingerprints (fingerprint, posted_at, tweet_id, twitter_account, mastodon_login, mastodon_instance) VALUES (?, ?, ?, ?, ?, ?)', (fingerprint, int(posted_at), tweet_id, *self.keys(destination)))  # noqa
+
+    # > Forget fingerprints posted before a time.
+    def prune_fingerprints(self, before):
+        self.db.execute('DELETE FROM fingerprints WHERE posted_at < ?', (before,))
+        self.sql.commit()
+
+
+    # Polls schedules (see `delay` and `--adaptive-polling`).
+    # > Last poll time and next poll time of a destination, or None if it never polled.
+    def poll_schedule(self, destination):
+        self.db.execute('SELECT polled_at, next_poll_at FROM polls WHERE twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', self.keys(destination))  # noqa
+
+        return self.db.fetchone()
+
+    # > Schedule the next poll of destinations.
+    def schedule_poll(self, destinations, polled_at, next_poll_at):
+        for destination in destinations:
+            self.db.execute('UPDATE polls SET polled_at = ?, next_poll_at = ? WHERE twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', (int(polled_at), int(next_poll_at), *self.keys(destination)))  # noqa
+
+            if self.db.rowcount == 0:
+                self.db.execute('INSERT INTO polls (twitter_account, polled_at, next_poll_at, mastodon_login, mastodon_instance) VALUES (?, ?, ?, ?, ?)', (self.twitter_account, int(polled_at), int(next_poll_at), destination.mastodon_login, destination.mastodon_instance))  # noqa
+
+        self.sql.commit()
+
+
+    # Backfills checkpoints (see `--backfill`).
+    # > Time before which the tweets have been backfilled for a destination, or None.
+    def backfilled_until(self, destination):
+        self.db.execute('SELECT backfilled_until FROM backfills WHERE twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', self.keys(destination))  # noqa
+        backfill_row = self.db.fetchone()
+
+        return backfill_row[0] if backfill_row is not None else None
+
+    # > Checkpoint the backfill of destinations, never moving a checkpoint back.
+    def checkpoint_backfill(self, destinations, backfilled_until):
+        for destination in destinations:
+            self.db.execute('UPDATE backfills SET backfilled_until = MAX(backfilled_until, ?) WHERE twitter_account = ? and mastodon_login = ? and mastodon_instance = ?', (int(backfilled_until), *self.keys(destination)))  # noqa
+
+            if self.db.rowcount == 0:
+                self.db.execute('INSERT INTO backfills (twitter_account, backfilled_until, mastodon_login, mastodon_instance) VALUES (?, ?, ?, ?)', (self.twitter_account, int(backfilled_until), destination.mastodon_login, destination.mastodon_instance))  # noqa
+
+        self.sql.commit()
@@ -0,0 +1,222 @@
+# Mastodon destinations, and the rate limits pacing their calls.
+# Note: Mastodon.py is only imported when connecting.
+
+import time
+
+from .config import kAPP_NAME, kRATELIMIT_INSTANCE, kRATELIMIT_ACCOUNT, kRATELIMIT_MEDIA
+from .utils import safe_int, safe_dict, locked_json_state
+
+
+# Raised when a rate limit would make us wait longer than we are ready to.
+class RateLimitWaitError(Exception):
+    pass
+
+# Token buckets pacing Mastodon calls, per instance, per account, and per account for media uploads.
+# Buckets are stored in a file shared by all the accounts running from the same directory, so separate
+#   cron invocations posting to the same instance share the same budget. They are synchronized with the
+#   'X-RateLimit-*' headers of the server responses.
+class RateLimiter:
+
+    def __init__(self, state_path, mastodon_instance, mastodon_login):
+        self.state_path = state_path
+        self.buckets_keys = {
+            'status': [ 'instance:' + mastodon_instance, 'account:' + mastodon_instance + ':' + mastodon_login ],
+            'media': [ 'instance:' + mastodon_instance, 'account:' + mastodon_instance + ':' + mastodon_login, 'media:' + mastodon_instance + ':' + mastodon_login ]
+            }
+
+    # Fetch a bucket from the state, and refill it.
+    def bucket(self, state, key, now):
+        bucket = state.get(key)
+
+        if bucket is None:
+            if key.startswith('instance:'):
+                capacity, window = kRATELIMIT_INSTANCE
+            elif key.startswith('media:'):
+                capacity, window = kRATELIMIT_MEDIA
+            else:
+                capacity, window = kRATELIMIT_ACCOUNT
+
+            bucket = { 'capacity': capacity, 'window': window, 'tokens': capacity, 'updated': now, 'blocked_until': 0 }
+            state[key] = bucket
+
+        elapsed = max(0, now - bucket['updated'])
+
+        bucket['tokens'] = min(bucket['capacity'], bucket['tokens'] + elapsed * bucket['capacity'] / bucket['window'])
+        bucket['updated'] = now
+
+        return bucket
+
+    # Wait for a token to be available in all the buckets of a kind of call ('status' or 'media'), and consume it.
+    # Raise `RateLimitWaitError` instead of waiting longer than `max_wait` seconds, if given.
+    def acquire(self, kind, logger = None, max_wait = None):
+
+        # Logger helper.
+        def llogger(*args):
+            if logger is not None:
+                logger(*args)
+
+        while True:
+            with locked_json_state(self.state_path) as state:
+                now = time.time()
+                buckets = [ self.bucket(state, key, now) for key in self.buckets_keys[kind] ]
+                wait = 0
+
+                for bucket in buckets:
+                    if bucket['blocked_until'] > now:
+                        wait = max(wait, bucket['blocked_until'] - now)
+                    elif bucket['tokens'] < 1:
+                        wait = max(wait, (1 - bucket['tokens']) * bucket['window'] / bucket['capacity'])
+
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket['tokens'] -= 1
+
+                    return
+
+            if max_wait is not None and wait > max_wait:
+                raise RateLimitWaitError('rate limit reached for %s calls, for %s seconds' % (kind, round(wait)))
+
+            llogger('rate limit reached for ', kind, ' calls, waiting ', round(wait, 1), ' seconds')
+            time.sleep(wait)
+
+    # Synchronize the most specific bucket of a kind of call with the last rate limit headers seen by the API.
+    def update(self, kind, mastodon_api, limited = False):
+        limit = safe_int(getattr(mastodon_api, 'ratelimit_limit', None))
+        remaining = safe_int(getattr(mastodon_api, 'ratelimit_remaining', None))
+        reset = getattr(mastodon_api, 'ratelimit_reset', None)
+
+        with locked_json_state(self.state_path) as state:
+            now = time.time()
+            bucket = self.bucket(state, self.buckets_keys[kind][-1], now)
+
+            if limit is not None and limit > 0:
+                bucket['capacity'] = limit
+
+            if remaining is not None and remaining >= 0:
+                bucket['tokens'] = min(bucket['tokens'], remaining)
+
+            if limited or (remaining is not None and remaining <= 0):
+                bucket['tokens'] = min(bucket['tokens'], 0)
+
+                # > If the server doesn't tell when the limit resets, wait for a full token.
+                if isinstance(reset, (int, float)) and reset > now:
+                    bucket['blocked_until'] = reset
+                else:
+                    bucket['blocked_until'] = now + bucket['window'] / bucket['capacity']
+
+# A Mastodon account to post toots to, with the configuration of its server.
+class Destination:
+
+    def __init__(self, mastodon_login, mastodon_passwd, mastodon_instance):
+        self.mastodon_login = mastodon_login
+        self.mastodon_passwd = mastodon_passwd
+        self.mastodon_instance = mastodon_instance
+        self.mastodon_api = None
+        self.rate_limiter = None
+
+        # > Server configuration, until we fetch the actual one.
+        self.mastodon_supported_mime_type = [
+            'abcd',
+            'image/jpeg',
+            'image/png',
+            'image/gif',
+            'image/heic',
+            'image/heif',
+            'image/webp',
+            'image/avif',
+            'video/webm',
+            'video/mp4',
+            'video/quicktime',
+            'video/ogg',
+            'audio/wave',
+            'audio/wav',
+            'audio/x-wav',
+            'audio/x-pn-wave',
+            'audio/vnd.wave',
+            'audio/ogg',
+            'audio/vorbis',
+            'audio/mpeg',
+            'audio/mp3',
+            'audio/webm',
+            'audio/flac',
+            'audio/aac',
+            'audio/m4a',
+            'audio/x-m4a',
+            'audio/mp4',
+            'audio/3gpp',
+            'video/x-ms-asf'
+            ]
+        self.mastodon_image_size_limit = 10485760 # 10 MiB.
+        self.mastodon_video_size_limit = 41943040 # 40 MiB.
+        self.mastodon_max_characters = 500
+        self.mastodon_max_media_attachments = 4
+
+    # Create the application on the instance if it does not exist, login, and fetch the server configuration.
+    # Return False on error.
+    def connect(self, account_path, ratelimit_state_path, logger = None, mastodon_scheme = 'https'):
+
+        # Logger helper.
+        def llogger(*args):
+            if logger is not None:
+                logger(*args)
+
+        from mastodon import Mastodon
+
+        # Create application if it does not exist.
+        mastodon_secret_path = account_path.joinpath(self.mastodon_instance + '.secret')
+        mastodon_base_url = mastodon_scheme + '://' + self.mastodon_instance
+
+        if not mastodon_secret_path.exists():
+            try:
+                app_created = Mastodon.create_app(kAPP_NAME, api_base_url = mastodon_base_url, to_file = mastodon_secret_path)
+            except Exception as e:
+                llogger('failed to create app on instance "', self.mastodon_instance, '" - ', e)
+                return False
+
+            if app_created:
+                llogger('tootbot app created on instance "', self.mastodon_instance, '"')
+            else:
+                llogger('failed to create app on instance "', self.mastodon_instance, '"')
+                return False
+
+        # Login to Mastodon.
+        llogger('login to Mastodon "' + self.mastodon_login + '"')
+
+        login_secret_path = account_path.joinpath(self.mastodon_login + '.secret')
+
+        try:
+            self.mastodon_api = Mastodon(client_id = mastodon_secret_path, api_base_url = mastodon_base_url, ratelimit_method = 'throw')
+
+            self.mastodon_api.log_in(
+                username = self.mastodon_login,
+                password = self.mastodon_passwd,
+                scopes = ['read', 'write'],
+                to_file = login_secret_path
+            )
+        except Exception as e:
+            llogger('login to Mastodon failed - ', e)
+            return False
+
+        # Pace calls with the rate limits shared with the other accounts.
+        self.rate_limiter = RateLimiter(ratelimit_state_path, self.mastodon_instance, self.mastodon_login)
+
+        # Set locale to English, so we can more easily match error messages.
+        try:
+            self.mastodon_api.set_language('en')
+        except Exception as e:
+            llogger('failed to change Mastodon locale - ', e)
+
+        # Fecth Mastodon server configuration.
+        try:
+            mastodon_instance_result = self.mastodon_api.instance()
+
+            self.mastodon_supported_mime_type = safe_dict(mastodon_instance_result, 'configuration.media_attachments.supported_mime_types', self.mastodon_supported_mime_type)
+            self.mastodon_image_size_limit = safe_dict(mastodon_instance_result, 'configuration.media_attachments.image_size_limit', self.mastodon_image_size_limit)
+            self.mastodon_video_size_limit = safe_dict(mastodon_instance_result, 'configuration.media_attachments.video_size_limit', self.mastodon_video_size_limit)
+            self.mastodon_max_characters = safe_dict(mastodon_instance_result, 'configuration.statuses.max_characters', self.mastodon_max_characters)
+            self.mastodon_max_media_attachments = safe_dict(mastodon_instance_result, 'configuration.statuses.max_media_attachments', self.mastodon_max_media_attachments)
+
+        except Exception as e:
+            llogger('failed to fetch Mastodon server configuration, use default - ', e)
+
+        return True
@@ -0,0 +1,209 @@
+# Politeness of outgoing requests, and links resolution policy, learned and shared per host.
+
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+
+from .config import kHOSTS_BACKOFF, kHOSTS_MAX_WAIT, kUNREDIR_HTTPS_TIMEOUTS, kUNREDIR_NO_REDIRECT_REQUESTS, kUNREDIR_POLICY_TTL
+from .utils import locked_json_state
+
+
+# Parse a 'Retry-After' header (delay in seconds, or HTTP date). Return seconds to wait, or None.
+def retry_after_seconds(value):
+    if value is None:
+        return None
+
+    try:
+        delay = int(value)
+    except ValueError:
+        import email.utils
+
+        try:
+            delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except Exception:
+            return None
+
+    return max(delay, 0)
+
+# Raised when a host asked to back off longer than we are ready to wait.
+class HostBlockedError(Exception):
+    pass
+
+# Scheduler of outgoing requests, enforcing per host concurrency and minimum interval between requests (see `kHOSTS_LIMITS`),
+#   and host wide backoffs asked by '429 Too Many Requests' responses.
+# It's shared by all the accounts running from the same directory: concurrency slots are lock files, so they are released
+#   even if a run crashes, and next allowed requests times are stored in a state file.
+class HostsScheduler:
+
+    def __init__(self, state_dir, limits):
+        self.state_dir = state_dir
+        self.state_path = state_dir.joinpath('hosts.json')
+        self.limits = limits
+
+        state_dir.mkdir(parents = True, exist_ok = True)
+
+    # Wait for a concurrency slot and for our turn, then send the request in the context.
+    @contextmanager
+    def request(self, host, logger = None):
+        host = host.lower()
+        concurrency, interval = self.limits.get(host, self.limits['*'])
+        slot = self.acquire_slot(host, concurrency, logger)
+
+        try:
+            self.wait_turn(host, interval, logger)
+
+            yield
+        finally:
+            slot.close()
+
+    # Wait for a free concurrency slot, giving up after `kHOSTS_MAX_WAIT` seconds.
+    def acquire_slot(self, host, concurrency, logger = None):
+
+        # Logger helper.
+        def llogger(*args):
+            if logger is not None:
+                logger(*args)
+
+        started_at = time.time()
+        waiting_logged = False
+
+        while True:
+            for slot_nbr in range(max(concurrency, 1)):
+                slot = open(self.state_dir.joinpath('%s.%s.lock' % (host, slot_nbr)), 'a')
+
+                try:
+                    fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot
+                except BlockingIOError:
+                    slot.close()
+
+            waited = time.time() - started_at
+
+            if waited > kHOSTS_MAX_WAIT:
+                raise HostBlockedError('no free slot for host "%s" after %s seconds' % (host, round(waited)))
+
+            if waited >= 1 and not waiting_logged:
+                llogger('waiting for a free slot for "', host, '"')
+                waiting_logged = True
+
+            time.sleep(0.1)
+
+    def wait_turn(self, host, interval, logger = None):
+
+        # Logger helper.
+        def llogger(*args):
+            if logger is not None:
+                logger(*args)
+
+        while True:
+            with locked_json_state(self.state_path) as state:
+                now = time.time()
+                entry = state.setdefault(host, { 'next_at': 0, 'blocked_until': 0 })
+
+                if entry['blocked_until'] - now > kHOSTS_MAX_WAIT:
+                    raise HostBlockedError('host "%s" asked to back off for %s seconds' % (host, round(entry['blocked_until'] - now)))
+
+                wait = max(entry['next_at'], entry['blocked_until']) - now
+
+                if wait <= 0:
+                    entry['next_at'] = now + interval
+
+                    # > Forget hosts we are done with.
+                    for key in [ key for key, value in state.items() if max(value['next_at'], value['blocked_until']) < now - kHOSTS_BACKOFF ]:
+                        del state[key]
+
+                    return
+
+            if wait >= 1:
+                llogger('waiting ', round(wait, 1), ' seconds before next request to "', host, '"')
+
+            time.sleep(wait)
+
+    # Block a host for all the runs, after a '429 Too Many Requests' response.
+    def backoff(self, host, retry_after = None, logger = None):
+
+        # Logger helper.
+        def llogger(*args):
+            if logger is not None:
+                logger(*args)
+
+        delay = retry_after_seconds(retry_after)
+
+        if delay is None:
+            delay = kHOSTS_BACKOFF
+
+        llogger('too many requests to "', host, '", backing off for ', round(delay), ' seconds')
+
+        with locked_json_state(self.state_path) as state:
+            entry = state.setdefault(host.lower(), { 'next_at': 0, 'blocked_until': 0 })
+            entry['blocked_until'] = max(entry['blocked_until'], time.time() + delay)
+
+# Links resolution policy learned per host: which scheme answers, typical latency, and whether it ever redirects.
+# Hosts are stored in a file shared by all the accounts running from the same directory. Observations are kept
+#   in memory during a run (it's used concurrently by the pipeline), and merged back in the file by `save()`.
+class UnredirPolicy:
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.lock = threading.Lock()
+        self.hosts = { }
+        self.updated_hosts = set()
+
+        try:
+            with locked_json_state(self.state_path) as state:
+                self.hosts = state
+        except Exception:
+            pass
+
+    # Fetch a host entry, forgetting it once it's too old, so hosts changing their behavior are learned again.
+    def host(self, host, now = None):
+        now = now or time.time()
+        entry = self.hosts.get(host)
+
+        if entry is None or now - entry.get('since', 0) > kUNREDIR_POLICY_TTL:
+            entry = { 'since': now, 'requests': 0, 'redirects': 0, 'https_timeouts': 0, 'https_answers': 0, 'latency': None }
+            self.hosts[host] = entry
+
+        return entry
+
+    def https_times_out(self, host):
+        with self.lock:
+            entry = self.host(host)
+
+            return entry['https_timeouts'] >= kUNREDIR_HTTPS_TIMEOUTS and entry['https_answers'] == 0
+
+    def never_redirects(self, host):
+        with self.lock:
+            entry = self.host(host)
+
+            return entry['requests'] >= kUNREDIR_NO_REDIRECT_REQUESTS and entry['redirects'] == 0
+
+    # Record the outcome of a request, latency being an exponential moving average of answered requests.
+    def record(self, host, scheme, latency = None, redirected = False, timed_out = False):
+        with self.lock:
+            entry = self.host(host)
+
+            if timed_out:
+                if scheme == 'https':
+                    entry['https_timeouts'] += 1
+            else:
+                entry['requests'] += 1
+                entry['redirects'] += 1 if redirected else 0
+
+                if scheme == 'https':
+                    entry['https_answers'] += 1
+
+                if latency is not None:
+                    entry['latency'] = round(latency if entry['latency'] is None else 0.8 * entry['latency'] + 0.2 * latency, 3)
+
+            self.updated_hosts.add(host)
+
+    # Merge hosts observed during this run into the state file.
+    def save(self):
+        with self.lock:
+            with locked_json_state(self.state_path) as state:
+                for host in self.updated_hosts:
+                    state[host] = self.hosts[host]
+
+            self.updated_hosts = set()
@@ -0,0 +1,172 @@
+# Links resolution.
+
+import re
+import html
+import time
+from contextlib import nullcontext
+from urllib.parse import urlsplit, urlunsplit, urljoin
+
+import requests
+
+from .config import kUNREDIR_GET_MAX_BYTES, kUNREDIR_GET_USER_AGENT
+
+
+# Resolve redirected links.
+# Note: if 'https' time-out, we retry with 'http'. It's unsafe, and in ideal it shouldn't be necessary,
+#   but there is a combination of issues for some redirect links which force us to do it:
+#     - Redirection like 't.co' may give an invalid https 301 / 'Location' (it doesn't generate this 301 / 'Location' response
+#           when the 'User-Agent' looks like a browser: instead, an HTML page is generated which redirect to the actual proper URL).
+#     - Redirection like 'u.afp.com' doesn't answer at all if accessed via 'https' / 443. They work only on 'http' / 80 (??!!).
+#   So we have to try 'http'.
+
+#   An alternative solution would be to do the same as browsers:
+#     - Pass a browser-like 'User-Agent'.
+#     - Use a 'GET' request instead of 'HEAD'.
+#     - Parse the resulting HTML content, and try to catch things like 'http-equiv="refresh"', 'location' JavaScript, etc.
+#   This is what `unredir_get()` does, see `--resolver get`.
+#
+# With a policy (see `UnredirPolicy`), what is learned about each host is used to skip these time-outs,
+#   and the requests to hosts which never redirect. With a scheduler (see `HostsScheduler`), requests respect
+#   the politeness limits of each host.
+def unredir(redir, policy = None, scheduler = None):
+    for redir_nbr in range(10):
+        redirs = urlsplit(redir)
+        redir_host = redirs[1].lower()
+
+        if policy is not None:
+            if policy.never_redirects(redir_host):
+                return redir
+
+            if redirs[0].lower() == 'https' and policy.https_times_out(redir_host):
+                redir = urlunsplit(('http', redirs[1], redirs[2], redirs[3], redirs[4]))
+
+        try:
+            with scheduler.request(redir_host) if scheduler is not None else nullcontext():
+                request_start = time.monotonic()
+                r = requests.head(redir, allow_redirects = False, timeout = 5)
+            
+            status_code = r.status_code
+            location = r.headers.get('Location')
+
+            if status_code == 429 and scheduler is not None:
+                scheduler.backoff(redir_host, r.headers.get('Retry-After'))
+                continue
+                
+        except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout) as e:
+            redirs = urlsplit(redir)
+            redir_scheme = redirs[0]
+
+            if policy is not None:
+                policy.record(redir_host, redir_scheme.lower(), timed_out = True)
+
+            if redir_scheme.lower() == 'https':
+                redir = urlunsplit(('http', redirs[1], redirs[2], redirs[3], redirs[4]))
+                continue
+            
+            return redir
+        
+        except Exception as e:
+            return redir
+
+        if policy is not None:
+            policy.record(redir_host, urlsplit(redir)[0].lower(), latency = time.monotonic() - request_start, redirected = status_code in { 301, 302 })
+
+        if status_code not in { 301, 302 }:
+            return redir
+
+        if 'http' not in location:
+            redir = re.sub(r'(https?://.*)/.*', r'\1', redir) + location
+        else:
+            redir = location
+
+    return redir
+
+# Find an HTML 'http-equiv="refresh"' or a JavaScript 'location' redirection in the start of a page.
+def find_html_redirection(content):
+    for meta in re.findall(r'<meta\s[^>]*>', content, re.IGNORECASE):
+        if re.search(r'http-equiv\s*=\s*["\']?refresh', meta, re.IGNORECASE):
+            match = re.search(r'content\s*=\s*["\']?\s*\d*\s*;?\s*url\s*=\s*["\']?([^"\'>\s]+)', meta, re.IGNORECASE)
+
+            if match is not None:
+                return html.unescape(match.group(1))
+
+    match = re.search(r'(?<![\w-])location(?:\.href)?\s*=\s*["\']([^"\']+)["\']|location\.(?:replace|assign)\(\s*["\']([^"\']+)["\']', content)
+
+    if match is not None:
+        return (match.group(1) or match.group(2)).replace('\\/', '/')
+
+    return None
+
+# Resolve redirected links with 'GET' requests, the way browsers do: HTTP redirections are followed by a single
+#   request, then the start of the last page is searched for HTML or JavaScript redirections (see `find_html_redirection()`)
+#   and the connection is closed without reading the rest. Most links are resolved with a single round trip.
+# Note: like `unredir()`, if 'https' time-out, we retry with 'http'. The scheduler only paces the first host of
+#   each request, redirections being followed by `requests`.
+def unredir_get(redir, policy = None, scheduler = None):
+    for redir_nbr in range(10):
+        redirs = urlsplit(redir)
+        redir_host = redirs[1].lower()
+
+        if policy is not None:
+            if policy.never_redirects(redir_host):
+                return redir
+
+            if redirs[0].lower() == 'https' and policy.https_times_out(redir_host):
+                redir = urlunsplit(('http', redirs[1], redirs[2], redirs[3], redirs[4]))
+
+        try:
+            with scheduler.request(redir_host) if scheduler is not None else nullcontext(), \
+                 requests.get(redir, stream = True, timeout = 5, headers = { 'User-Agent': kUNREDIR_GET_USER_AGENT }) as r:
+                content = b''
+
+                if 'html' in r.headers.get('Content-Type', ''):
+                    for chunk in r.iter_content(1024):
+                        content += chunk
+
+                        if len(content) >= kUNREDIR_GET_MAX_BYTES:
+                            break
+
+                responses = r.history + [ r ]
+
+                if r.status_code == 429 and scheduler is not None:
+                    scheduler.backoff(urlsplit(r.url)[1], r.headers.get('Retry-After'))
+
+                    if r.url == redir:
+                        continue
+
+                redir = r.url
+
+        except (requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout) as e:
+            # > The time-out may happen after some redirections.
+            if e.request is not None and e.request.url is not None:
+                redir = e.request.url
+
+            redirs = urlsplit(redir)
+            redir_scheme = redirs[0]
+
+            if policy is not None:
+                policy.record(redirs[1].lower(), redir_scheme.lower(), timed_out = True)
+
+            if redir_scheme.lower() == 'https':
+                redir = urlunsplit(('http', redirs[1], redirs[2], redirs[3], redirs[4]))
+                continue
+
+            return redir
+
+        except Exception as e:
+            return redir
+
+        location = find_html_redirection(content.decode(r.encoding or 'utf-8', errors = 'replace'))
+
+        if policy is not None:
+            for response in responses:
+                responses_redirs = urlsplit(response.url)
+                policy.record(responses_redirs[1].lower(), responses_redirs[0].lower(), latency = response.elapsed.total_seconds(),
+                              redirected = response is not r or location is not None)
+
+        if location is None:
+            return redir
+
+        redir = urljoin(redir, location)
+
+    return redir
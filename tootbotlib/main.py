@@ -0,0 +1,901 @@
+# Run tootbot for a Twitter account.
+# Note: only the light modules are imported here, the network and medias stages (Mastodon.py, requests, ffmpeg helpers)
+#   are imported by the functions using them, so runs with nothing to post start fast.
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from contextlib import nullcontext
+
+from .config import kBACKFILL_INDEX_DELAY, kBACKFILL_PAUSE, kBACKFILL_RUN_SECONDS, kBACKFILL_WINDOW, kHOSTS_LIMITS, kPIPELINE_STAGES, kPOLL_MIN_INTERVAL, kPOLL_RATE_DAYS, kPOLL_RATE_TWEETS, kRETRY_BASE_DELAY, kRETRY_MAX_ATTEMPTS, kRETRY_MAX_DELAY
+from .utils import safe_int, stringify, tweet_id_at, tweet_timestamp, unlink_noerr, RunLock
+from .hosts import HostsScheduler, UnredirPolicy
+from .metrics import metrics, outcome_name
+from .polling import poll_interval
+from .store import MediasStore
+from .destination import Destination
+from .database import Database
+from .composer import TootsComposer
+from .twitter import fetch_tweets_between
+
+
+def main():
+    root_path = Path()
+    run_start = time.monotonic()
+
+
+    # Parse arguments.
+    parser = argparse.ArgumentParser(prog = 'tootbot.py')
+
+    parser.add_argument('twitter_account')
+    parser.add_argument('mastodon_login')
+    parser.add_argument('mastodon_passwd')
+    parser.add_argument('mastodon_instance')
+    parser.add_argument('max_days', nargs = '?', type = int, default = 1)
+    parser.add_argument('footer_tags', nargs = '?', default = None)
+    parser.add_argument('delay', nargs = '?', type = int, default = 0,
+                        help = 'minimum delay between polls of the account, in seconds, runs in between only retrying queued toots (default: 0, poll on each run)')
+    parser.add_argument('--destination', action = 'append', nargs = 3, metavar = ('MASTODON_LOGIN', 'MASTODON_PASSWD', 'MASTODON_INSTANCE'),
+                        help = 'also post to this Mastodon account, sharing the tweets fetch, links resolutions and medias downloads (can be repeated)')
+    parser.add_argument('--pipeline', type = int, default = 1, metavar = 'N',
+                        help = 'prepare up to N tweets concurrently (quotes, links, medias), toots are still posted in order (default: 1)')
+    parser.add_argument('--parallel-conversations', type = int, default = 1, metavar = 'N',
+                        help = 'post up to N independent conversations concurrently, each one in order (default: 1, all toots in order)')
+    parser.add_argument('--ratelimit-state', type = Path, default = root_path.joinpath('ratelimits.json'),
+                        help = 'file where Mastodon rate limits are shared by all accounts (default: ratelimits.json)')
+    parser.add_argument('--if-running', choices = [ 'coalesce', 'exit' ], default = 'coalesce',
+                        help = 'when another run of the same account is in progress, ask it for one more pass (coalesce) or just exit (default: coalesce)')
+    parser.add_argument('--database', type = Path, default = None,
+                        help = 'database shared by all accounts (default: "<twitter_account>/tootbot.db")')
+    parser.add_argument('--prune-days', type = int, default = None, metavar = 'N',
+                        help = 'forget processed tweets older than N days (except the last toot of recent conversations), and compact the database')
+    parser.add_argument('--prune-conversation-days', type = int, default = None, metavar = 'N',
+                        help = 'with --prune-days, keep the last toot of threads replied to in the last N days, so next replies are still threaded (default: the --prune-days value)')
+    parser.add_argument('--resolver', choices = [ 'head', 'get' ], default = 'head',
+                        help = 'resolve links with HEAD requests chains, or with single GET requests following HTML and JavaScript redirections (default: head)')
+    parser.add_argument('--hosts-state', type = Path, default = root_path.joinpath('hosts'),
+                        help = 'directory where outgoing requests limits per host are shared by all accounts (default: hosts)')
+    parser.add_argument('--host-limit', action = 'append', nargs = 3, metavar = ('HOST', 'CONCURRENCY', 'INTERVAL'),
+                        help = 'maximum concurrent requests and minimum interval in seconds between requests to a host, "*" for other hosts (can be repeated)')
+    parser.add_argument('--unredir-state', type = Path, default = root_path.joinpath('unredir.json'),
+                        help = 'file where the links resolution policy learned per host is shared by all accounts (default: unredir.json)')
+    parser.add_argument('--profile', action = 'store_true',
+                        help = 'profile CPU time and memory allocations, written to "profile.prof" and "profile.txt" in the account directory')
+    parser.add_argument('--instance-scheme', choices = [ 'https', 'http' ], default = 'https',
+                        help = 'scheme of the Mastodon instances, "http" being only meant for tests (see tools/fake_mastodon.py) (default: https)')
+    parser.add_argument('--replay', type = Path, default = None, metavar = 'TWEETS_FILE',
+                        help = 'read tweets from a file recorded by twint (JSON, or one JSON object per line) instead of fetching them, quoted tweets being looked up in it')
+    parser.add_argument('--adaptive-polling', action = 'store_true',
+                        help = 'learn the posting rate of the account, and poll it more or less often, never sooner than `delay` (run tootbot every few minutes)')
+    parser.add_argument('--medias-store', type = Path, default = None, metavar = 'DIR',
+                        help = 'directory where downloaded medias are stored by content hash, and reused by the next runs of all accounts for a day')
+    parser.add_argument('--skip-duplicates', type = float, default = None, metavar = 'HOURS',
+                        help = 'skip a toot if the destination posted the same text with the same medias in the last HOURS hours (across accounts with `--database`)')
+    parser.add_argument('--backfill', action = 'store_true',
+                        help = 'fetch the tweets of the last `max_days` days, day by day and oldest first, instead of the last ones, resuming from where the previous run stopped')
+    parser.add_argument('--metrics-dir', type = Path, default = None,
+                        help = 'write metrics to "tootbot-<twitter_account>.prom" in this directory (node_exporter textfile collector)')
+
+    args = parser.parse_args()
+
+
+    # Extract arguments.
+    twitter_account = args.twitter_account
+    mastodon_login = args.mastodon_login
+    mastodon_passwd = args.mastodon_passwd
+    mastodon_instance = args.mastodon_instance
+    max_days = args.max_days
+    footer_tags = args.footer_tags
+    delay = args.delay
+
+
+    # Forge log prefix.
+    log_prefix = twitter_account + ':'
+
+    def log(*args):
+        result = stringify(*args)
+
+        if len(result) > 0:
+            result = result[:1].upper() + result[1:]
+
+        if len(result) > 0 and result[-1] != '.':
+            result += '.'
+
+        print(log_prefix, result.replace('\n', ' '))
+
+    # Setup outgoing requests scheduler.
+    hosts_limits = dict(kHOSTS_LIMITS)
+
+    for host, concurrency, interval in args.host_limit or []:
+        hosts_limits[host.lower()] = (int(concurrency), float(interval))
+
+    hosts_scheduler = HostsScheduler(args.hosts_state, hosts_limits)
+
+    # Create directory for Twitter account.
+    account_path = root_path.joinpath(twitter_account)
+
+    if account_path.exists():
+        if not account_path.is_dir():
+            log('cannot create directory "', account_path, '" because a file with this name altready exists')
+            sys.exit(1)
+    else:
+        try:
+            os.mkdir(twitter_account)
+        except Exception as e:
+            log('cannot create directory "', account_path, '" - ', e)
+            sys.exit(1)
+
+
+    # Lock account directory.
+    # Note: the request is the command line, so overlapping runs for other destinations (or options) get their own pass.
+    run_lock = RunLock(account_path.joinpath('tootbot.lock'), account_path.joinpath('tootbot.pending'))
+    run_request = [ os.path.abspath(sys.argv[0]) ] + sys.argv[1:]
+
+    if not run_lock.acquire(run_request, request_pass = args.if_running == 'coalesce'):
+        if args.if_running == 'coalesce':
+            log('another run is in progress, it will do one more pass')
+        else:
+            log('another run is in progress, exit (it will do one more pass if it runs another command line)')
+
+        sys.exit(0)
+
+    # > Start the extra pass once everything else is flushed, this handler being the first registered it's the last run.
+    another_pass = None
+
+    def run_another_pass():
+        if another_pass is not None:
+            sys.stdout.flush()
+            os.execv(sys.executable, [ sys.executable ] + another_pass)
+
+    atexit.register(run_another_pass)
+
+
+    # Setup profiling.
+    profiler = None
+    thread_profilers = []
+    thread_profilers_lock = threading.Lock()
+
+    if args.profile:
+        import cProfile
+        import pstats
+        import tracemalloc
+
+        tracemalloc.start(10)
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        # > Write profile and allocations, and log a summary, on every exit path.
+        def write_profile():
+            profiler.disable()
+
+            profile_path = account_path.joinpath('profile.prof')
+            report_path = account_path.joinpath('profile.txt')
+            snapshot = tracemalloc.take_snapshot().filter_traces([ tracemalloc.Filter(False, tracemalloc.__file__) ])
+            current_memory, peak_memory = tracemalloc.get_traced_memory()
+
+            tracemalloc.stop()
+
+            try:
+                stats = pstats.Stats(profiler)
+
+                for thread_profiler in thread_profilers:
+                    stats.add(thread_profiler)
+
+                stats.dump_stats(profile_path)
+
+                with open(report_path, 'w') as file:
+                    file.write('# Functions, by cumulative time.\n')
+                    pstats.Stats(str(profile_path), stream = file).sort_stats('cumulative').print_stats(40)
+
+                    file.write('# Allocation sites, by size (current: %s bytes, peak: %s bytes).\n\n' % (current_memory, peak_memory))
+
+                    for stat in snapshot.statistics('lineno')[:30]:
+                        file.write('%s\n' % (stat))
+
+                log('profile written to "', profile_path, '" and "', report_path, '" - ', round(stats.total_tt, 2), ' seconds of CPU, ', round(peak_memory / (1024 * 1024), 1), ' MiB peak memory')  # noqa
+
+                for (filename, line, function), (_, _, own_time, cumulative_time, _) in sorted(stats.stats.items(), key = lambda item: -item[1][2])[:5]:
+                    log('  ', round(own_time, 3), ' seconds (', round(cumulative_time, 3), ' cumulative) in ', function, ' - ', os.path.basename(filename), ':', line)
+            except Exception as e:
+                log('cannot write profile - ', e)
+
+        atexit.register(write_profile)
+
+    # > Profile a function run by a worker thread, `cProfile` only seeing the thread which enabled it.
+    # > Note: since Python 3.12, `cProfile` sees all the threads, and a second profiler can't be enabled.
+    def profiled(function):
+        if profiler is None or sys.version_info >= (3, 12):
+            return function
+
+        def profiled_function(*args, **kwargs):
+            thread_profiler = cProfile.Profile()
+
+            try:
+                return thread_profiler.runcall(function, *args, **kwargs)
+            finally:
+                with thread_profilers_lock:
+                    thread_profilers.append(thread_profiler)
+
+        return profiled_function
+
+
+    # Setup metrics.
+    if args.metrics_dir is not None:
+        metrics_state_path = account_path.joinpath('metrics.json')
+        metrics_textfile_path = args.metrics_dir.joinpath('tootbot-' + twitter_account + '.prom')
+
+        metrics.base_labels = { 'account': twitter_account }
+        metrics.load(metrics_state_path)
+        metrics.inc('tootbot_runs_total')
+        metrics.set('tootbot_last_run_success', 0)
+
+        # > Flush on every exit path, including errors.
+        def write_metrics():
+            metrics.set('tootbot_last_run_timestamp_seconds', int(time.time()))
+            metrics.set('tootbot_last_run_duration_seconds', round(time.monotonic() - run_start, 3))
+
+            try:
+                metrics.save(metrics_state_path)
+                metrics.write_textfile(metrics_textfile_path)
+            except Exception as e:
+                log('cannot write metrics - ', e)
+
+        atexit.register(write_metrics)
+
+
+    # Open database.
+    sql_path = args.database if args.database is not None else account_path.joinpath('tootbot.db')
+
+    try:
+        database = Database(sql_path, twitter_account, shared = args.database is not None, incremental_vacuum = args.prune_days is not None, logger = log)
+    except Exception as e:
+        log('cannot open database file "', sql_path, '" - ', e)
+        sys.exit(1)
+
+    # Prefix logs with the destination, when posting to several ones.
+    def destination_logger(destination, logger):
+        if len(destinations) <= 1:
+            return logger
+
+        def dlogger(*args):
+            logger('[', destination.mastodon_login, ' on ', destination.mastodon_instance, '] ', *args)
+
+        return dlogger
+
+
+    # Mastodon destinations.
+    destinations = [ Destination(mastodon_login, mastodon_passwd, mastodon_instance) ]
+
+    for destination_args in args.destination or []:
+        destinations.append(Destination(*destination_args))
+
+    # > Connect to the destinations, only once there is something to post, and drop the ones failing to connect.
+    def connect_destinations():
+        destinations[:] = [ destination for destination in destinations
+                            if destination.mastodon_api is not None or destination.connect(account_path, args.ratelimit_state, destination_logger(destination, log), args.instance_scheme) ]  # noqa
+
+        if len(destinations) == 0:
+            sys.exit(1)
+
+
+    # Posting helpers.
+    # > Mark a tweet as processed.
+    def mark_tweet_as_processed(destination, tweet_id, tweet_conversation_id, toot_id):
+        database.mark_tweet_as_processed(destination, tweet_id, tweet_conversation_id, toot_id)
+
+        metrics.inc('tootbot_tweets_total', mastodon_login = destination.mastodon_login, mastodon_instance = destination.mastodon_instance,
+                    outcome = outcome_name(toot_id), code = min(toot_id, 0))
+
+    # > Check if a destination posted the same toot recently, or is about to, and reserve its fingerprint for this run (see `--skip-duplicates`).
+    posting_fingerprints = set()
+
+    def toot_is_duplicate(destination, toot):
+        if args.skip_duplicates is None or toot.get('fingerprint') is None:
+            return False
+
+        key = (destination.mastodon_login, destination.mastodon_instance, toot['fingerprint'])
+
+        if key in posting_fingerprints:
+            return True
+
+        posting_fingerprints.add(key)
+
+        return database.fingerprint_is_known(destination, toot['fingerprint'], time.time() - args.skip_duplicates * 3600)
+
+    # > Fingerprints posted recently or waiting in the retry queue, loaded before tweets are prepared, so `compose_toot()` can
+    # >   skip duplicates before uploading their medias, without accessing the database.
+    recent_fingerprints = set()
+
+    def load_recent_fingerprints():
+        if args.skip_duplicates is not None:
+            recent_fingerprints.update(database.known_fingerprints(time.time() - args.skip_duplicates * 3600))
+
+    # > Check if a destination posted a toot recently, from the loaded fingerprints, without reserving it.
+    def fingerprint_is_recent(destination, fingerprint):
+        if args.skip_duplicates is None:
+            return False
+
+        key = (destination.mastodon_login, destination.mastodon_instance, fingerprint)
+
+        return key in recent_fingerprints or key in posting_fingerprints
+
+    # > Find the toot to reply to, if the tweet is part of a conversation.
+    def find_reply_to_id(destination, tweet_id, tweet_conversation_id):
+        try:
+            return database.find_reply_to_id(destination, tweet_conversation_id)
+        except Exception as e:
+            destination_logger(destination, log)('cannot check if tweet ', tweet_id, ' is part of a conversation - ', e)
+
+        return None
+
+    # > Send a toot to Mastodon. Return `(toot_id, None)` on success, or `(None, error)`.
+    # > Note: it doesn't access the database, so conversations can be posted concurrently (see `--parallel-conversations`).
+    def send_toot(destination, toot, toot_reply_to_id, log):
+
+        # Log.
+        if toot_reply_to_id is None:
+            log('posting toot')
+        else:
+            log('posting toot as reply of toot ', toot_reply_to_id, ' - twitter conversation ',  toot['tweet_conversation_id'])
+
+        # Post.
+        from .posting import mastodon_post
+
+        try:
+            with metrics.timer('tootbot_post_seconds'):
+                result = mastodon_post(destination.mastodon_api, toot['content'], toot_reply_to_id, toot['photos_ids'], toot['videos_ids'], log, destination.rate_limiter, toot['medias_uploaded_at'])  # noqa
+
+            return (safe_int(result["id"]), None)
+
+        except Exception as e:
+            return (None, e)
+
+    # > Record the result of `send_toot()`. On transient error, the toot is queued to be retried later with an exponential backoff.
+    # > Return True if the toot is done with (posted, or given up), False if it's still in the queue.
+    def record_toot(destination, toot, sent):
+        dlog = destination_logger(destination, log)
+        tweet_id = toot['tweet_id']
+        tweet_conversation_id = toot['tweet_conversation_id']
+        toot_id, error = sent
+
+        from .posting import PostDeferredError
+
+        # Posted.
+        if error is None:
+            # > Mark as processed.
+            database.unqueue_toot(destination, toot)
+
+            if args.skip_duplicates is not None and toot.get('fingerprint') is not None:
+                database.remember_fingerprint(destination, tweet_id, toot['fingerprint'], time.time())
+
+            mark_tweet_as_processed(destination, tweet_id, tweet_conversation_id, toot_id)
+
+            # > Log post.
+            dlog('tweet ', tweet_id, ' created at ', toot['tweet_created_at'], ' has been posted on ', destination.mastodon_instance, ' - toot-id:', toot_id)
+
+            return True
+
+        # Transient error.
+        if isinstance(error, PostDeferredError):
+            attempts = toot['attempts'] + 1
+
+            # > Give up.
+            if attempts >= kRETRY_MAX_ATTEMPTS:
+                dlog('can\'t post toot after ', attempts, ' attempts, give up - ', error)
+
+                database.unqueue_toot(destination, toot)
+                mark_tweet_as_processed(destination, tweet_id, tweet_conversation_id, -6)
+
+                return True
+
+            # > Queue for later.
+            retry_delay = min(kRETRY_MAX_DELAY, kRETRY_BASE_DELAY * 2 ** (attempts - 1))
+
+            dlog('can\'t post toot, will retry in ', retry_delay, ' seconds - ', error)
+
+            database.queue_toot(destination, toot, attempts, int(time.time()) + retry_delay, str(error))
+
+            return False
+
+        # Other errors.
+        # > Log the error.
+        dlog('can\'t post toot - ', error)
+
+        # > Mark as processed.
+        database.unqueue_toot(destination, toot)
+        mark_tweet_as_processed(destination, tweet_id, tweet_conversation_id, -6)
+
+        return True
+
+    # > Post a toot, replying to the last toot of its conversation.
+    def post_toot(destination, toot):
+        toot_reply_to_id = find_reply_to_id(destination, toot['tweet_id'], toot['tweet_conversation_id'])
+
+        return record_toot(destination, toot, send_toot(destination, toot, toot_reply_to_id, destination_logger(destination, log)))
+
+
+    # Drain the retry queues, oldest first.
+    # Note: as soon as a toot of a conversation can't be posted, the next toots of the same conversation are kept in the queue,
+    #   so replies are always posted after the toot they reply to.
+    if database.has_due_toots(time.time()):
+        connect_destinations()
+
+    for destination in destinations:
+        dlog = destination_logger(destination, log)
+
+        queued_toots = database.queued_toots(destination)
+
+        if len(queued_toots) > 0:
+            dlog('retry ', len(queued_toots), ' queued toots')
+
+        blocked_conversations = set()
+
+        for toot, next_attempt_at in queued_toots:
+            if toot['tweet_conversation_id'] is not None and toot['tweet_conversation_id'] in blocked_conversations:
+                continue
+
+            if next_attempt_at > time.time():
+                done = False
+            else:
+                dlog('--- ', str(toot['tweet_id']), ' (retry ', toot['attempts'], ')')
+                done = post_toot(destination, toot)
+
+            if not done and toot['tweet_conversation_id'] is not None:
+                blocked_conversations.add(toot['tweet_conversation_id'])
+
+
+    # Check if the account is due for a poll (see `delay` and `--adaptive-polling`), runs in between only retrying queued toots.
+    # Note: a backfill in progress goes on at each run (see `--backfill`).
+    # Note: the account is polled as soon as one of the destinations of the run is due.
+    next_polls_at = []
+
+    for destination in destinations:
+        poll_row = database.poll_schedule(destination)
+        next_polls_at.append(0 if poll_row is None else poll_row[1] if args.adaptive_polling else poll_row[0] + delay)
+
+    next_poll_at = min(next_polls_at)
+    poll_due = next_poll_at <= time.time()
+
+    # > Backfill checkpoint of a destination: tweets before it have been backfilled (see `--backfill`).
+    def backfilled_until(destination):
+        return max(database.backfilled_until(destination) or 0, time.time() - max_days * 86400)
+
+    # > Backfills resume from the destination which is the most behind.
+    if args.backfill:
+        backfill_from = min(backfilled_until(destination) for destination in destinations)
+
+        if not poll_due and backfill_from < time.time() - kBACKFILL_WINDOW:
+            log('backfill in progress since ', time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(backfill_from)))
+            poll_due = True
+
+    if not poll_due:
+        log('next poll in ', round(next_poll_at - time.time()), ' seconds')
+
+
+    # Load tweets recorded by twint (JSON, or one JSON object per line).
+    def load_tweets(json_path):
+        try:
+            with open(json_path, 'r') as file:
+                content = file.read()
+
+            if content.lstrip().startswith('['):
+                return json.loads(content)
+            else:
+                return [ json.loads(line) for line in content.splitlines() if len(line.strip()) > 0 ]
+        except Exception as e:
+            log('failed to parse tweets - ', e)
+            sys.exit(1)
+
+    # Fetch the last tweets, or read the replayed ones.
+    def fetch_tweets():
+        if args.replay is not None:
+            log('replaying tweets from "', args.replay, '"')
+
+            return load_tweets(args.replay)
+
+        # > Remove previous fetched tweets.
+        for path in account_path.glob('tweets.*json'):
+            unlink_noerr(path)
+
+        # > Fetch.
+        twitter_sjson_path = account_path.joinpath('tweets.sjson')
+        twitter_json_path = account_path.joinpath('tweets.json')
+
+        log('fetching tweets')
+
+        try:
+            with hosts_scheduler.request('twitter.com', log), metrics.timer('tootbot_fetch_seconds', kind = 'timeline'):
+                subprocess.run("twint -u '%s' -tl --full-text --limit 10 --json -o '%s'" % (twitter_account, str(twitter_sjson_path)), shell = True, capture_output = True, check = True, timeout = 60)  # noqa
+                subprocess.run("jq -s . '%s' > '%s'" % (str(twitter_sjson_path), str(twitter_json_path)), shell = True, capture_output = True, check = True)
+        except Exception as e:
+            log('failed to fetch tweets - ', e)
+            sys.exit(1)
+
+        return load_tweets(twitter_json_path)
+
+    # > Backfills fetch tweets window by window instead (see `backfill()`).
+    tweets = []
+
+    if poll_due and not args.backfill:
+        tweets = fetch_tweets()
+
+        log('fetched ', len(tweets), ' tweets')
+        metrics.set('tootbot_fetched_tweets', len(tweets))
+
+    # > Quoted tweets are looked up in replayed tweets.
+    replayed_tweets = None
+
+    if args.replay is not None:
+        replayed_tweets = { safe_int(tweet['id']): tweet for tweet in (load_tweets(args.replay) if args.backfill else tweets) }
+
+
+    # Load links resolution policy.
+    unredir_policy = UnredirPolicy(args.unredir_state)
+
+
+    # Open medias store.
+    medias_store = None
+
+    if args.medias_store is not None:
+        try:
+            medias_store = MediasStore(args.medias_store)
+        except Exception as e:
+            log('cannot open medias store "', args.medias_store, '" - ', e)
+
+
+    # Concurrency limits of the network stages.
+    if args.pipeline > 1:
+        stages = { stage: threading.BoundedSemaphore(limit) for stage, limit in kPIPELINE_STAGES.items() }
+    else:
+        stages = { stage: nullcontext() for stage in kPIPELINE_STAGES }
+
+
+    # Tweets and toots stages.
+    composer = TootsComposer(twitter_account, account_path, footer_tags, hosts_scheduler, unredir_policy, stages, resolver = args.resolver,
+                             medias_store = medias_store, replayed_tweets = replayed_tweets, fingerprint_is_recent = fingerprint_is_recent)
+
+
+    # Prepare the toots of a tweet for some destinations.
+    # Return a dictionary of toots to post, or outcome codes (negative 'toot_id') of skipped tweets, by destination.
+    # Note: with `--pipeline`, it runs concurrently for several tweets, so it must not access the database.
+    def prepare_toot(tweet, tweet_destinations, log):
+        processed = composer.process_tweet(tweet, log)
+
+        if isinstance(processed, int):
+            return { destination: processed for destination in tweet_destinations }
+
+        # Compose toots, sharing downloaded medias between destinations.
+        medias = { }
+
+        try:
+            return { destination: composer.compose_toot(destination, processed, medias, destination_logger(destination, log)) for destination in tweet_destinations }
+        finally:
+            if medias_store is None:
+                for media in medias.values():
+                    if isinstance(media, tuple) and isinstance(media[0], Path):
+                        unlink_noerr(media[0])
+
+
+    # Post a prepared toot, or record why its tweet has been skipped.
+    def handle_prepared_toot(destination, tweet, toot):
+        tweet_id = safe_int(tweet['id'])
+        tweet_conversation_id = safe_int(tweet['conversation_id'])
+
+        # Skipped.
+        if isinstance(toot, int):
+            mark_tweet_as_processed(destination, tweet_id, tweet_conversation_id, toot)
+            return
+
+        # Skip duplicates of toots posted recently.
+        if toot_is_duplicate(destination, toot):
+            destination_logger(destination, log)('tweet ', tweet_id, ' skipped - the same toot has been posted recently')
+            mark_tweet_as_processed(destination, tweet_id, tweet_conversation_id, -7)
+            return
+
+        # Post, or queue behind the previous toots of the conversation which are waiting in the retry queue.
+        if database.conversation_is_queued(destination, tweet_conversation_id):
+            destination_logger(destination, log)('previous toots of twitter conversation ', tweet_conversation_id, ' are waiting to be posted, queue this one behind them')
+            database.queue_toot(destination, toot, 0, 0, 'waiting for previous toots of the conversation')
+        else:
+            post_toot(destination, toot)
+
+
+    # Prepare tweets, in order.
+    def prepare_toots(tweets):
+        if args.pipeline <= 1:
+            for tweet, tweet_destinations in tweets:
+                yield (tweet, prepare_toot(tweet, tweet_destinations, log))
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # > Prepare tweets concurrently, each one logging in its own buffer, and yield them in order as soon as they are ready.
+            with ThreadPoolExecutor(max_workers = args.pipeline) as executor:
+                pending_tweets = []
+
+                for tweet, tweet_destinations in tweets:
+                    tweet_logs = []
+                    future = executor.submit(profiled(prepare_toot), tweet, tweet_destinations, lambda *args, tweet_logs = tweet_logs: tweet_logs.append(args))
+
+                    pending_tweets.append((tweet, tweet_logs, future))
+
+                for tweet, tweet_logs, future in pending_tweets:
+                    toots = future.result()
+
+                    for tweet_log in tweet_logs:
+                        log(*tweet_log)
+
+                    yield (tweet, toots)
+
+
+    # Post prepared toots, with independent conversations posted concurrently.
+    # Note: the toots of a conversation are posted in order by the same worker, which passes the id of each posted toot
+    #   to the next one as 'in reply to' id, instead of querying the database.
+    def post_conversations(prepared_toots):
+        import queue
+        from concurrent.futures import ThreadPoolExecutor
+        from .posting import PostDeferredError
+
+        # Group toots by destination and conversation. Tweets without conversation are their own conversation.
+        conversations = { }
+
+        for tweet, toots in prepared_toots:
+            for destination, toot in toots.items():
+                if isinstance(toot, int) or toot_is_duplicate(destination, toot):
+                    handle_prepared_toot(destination, tweet, toot)
+                    continue
+
+                if toot['tweet_conversation_id'] is None:
+                    conversation_key = (destination, 'tweet', toot['tweet_id'])
+                else:
+                    conversation_key = (destination, 'conversation', toot['tweet_conversation_id'])
+
+                conversations.setdefault(conversation_key, []).append(toot)
+
+        # Find where each conversation starts. Conversations waiting in the retry queue stay behind.
+        ready_conversations = []
+
+        for conversation_key, toots in conversations.items():
+            destination = conversation_key[0]
+            tweet_conversation_id = toots[0]['tweet_conversation_id']
+
+            if database.conversation_is_queued(destination, tweet_conversation_id):
+                destination_logger(destination, log)('previous toots of twitter conversation ', tweet_conversation_id, ' are waiting to be posted, queue ', len(toots), ' toots behind them')
+
+                for toot in toots:
+                    database.queue_toot(destination, toot, 0, 0, 'waiting for previous toots of the conversation')
+            else:
+                ready_conversations.append((destination, toots, find_reply_to_id(destination, toots[0]['tweet_id'], tweet_conversation_id)))
+
+        # Post a conversation, until a toot has to be retried later. Each result is handed back as soon as the toot is sent,
+        #   so it's recorded even if the run stops before the end of the conversation.
+        def post_conversation(conversation_nbr, destination, toots, toot_reply_to_id, log):
+            try:
+                for toot in toots:
+                    log('--- ', str(toot['tweet_id']))
+
+                    sent = send_toot(destination, toot, toot_reply_to_id, log)
+                    results_queue.put((conversation_nbr, toot, sent))
+
+                    if isinstance(sent[1], PostDeferredError):
+                        break
+
+                    if sent[0] is not None and sent[0] > 0:
+                        toot_reply_to_id = sent[0]
+            finally:
+                results_queue.put((conversation_nbr, None, None))
+
+        # Post conversations concurrently, and record results as they come.
+        results_queue = queue.Queue()
+
+        with ThreadPoolExecutor(max_workers = args.parallel_conversations) as executor:
+            conversations = { }
+
+            for conversation_nbr, (destination, toots, toot_reply_to_id) in enumerate(ready_conversations):
+                conversation_logs = []
+                conversation_log = destination_logger(destination, lambda *args, conversation_logs = conversation_logs: conversation_logs.append(args))
+                future = executor.submit(profiled(post_conversation), conversation_nbr, destination, toots, toot_reply_to_id, conversation_log)
+
+                conversations[conversation_nbr] = (future, destination, toots, conversation_logs, set())
+
+            while len(conversations) > 0:
+                conversation_nbr, toot, sent = results_queue.get()
+                future, destination, toots, conversation_logs, recorded_ids = conversations[conversation_nbr]
+
+                # > Replay the logs of the conversation so far.
+                logs_count = len(conversation_logs)
+
+                for conversation_log in conversation_logs[:logs_count]:
+                    log(*conversation_log)
+
+                del conversation_logs[:logs_count]
+
+                # > Record the toot.
+                if toot is not None:
+                    record_toot(destination, toot, sent)
+                    recorded_ids.add(toot['tweet_id'])
+                    continue
+
+                # > Conversation done, queue the toots left behind.
+                del conversations[conversation_nbr]
+
+                for toot in toots:
+                    if toot['tweet_id'] not in recorded_ids:
+                        database.queue_toot(destination, toot, 0, 0, 'waiting for previous toots of the conversation')
+
+                future.result()
+
+
+    # Handle tweets, newest first as fetched by twint: select the ones still to post, oldest first, with the destinations
+    #   they still have to be posted to, then prepare and post them.
+    def handle_tweets(tweets):
+        new_tweets = []
+
+        for tweet in reversed(tweets):
+            tweet_id = safe_int(tweet['id'])
+            tweet_destinations = []
+
+            # Check if this tweet has been processed, or is waiting in the retry queue.
+            for destination in destinations:
+                try:
+                    if not database.tweet_is_processed(destination, tweet_id) and not database.tweet_is_queued(destination, tweet_id):
+                        tweet_destinations.append(destination)
+                except Exception as e:
+                    log('cannot check if tweet ', tweet_id, ' exist in database - ', e)
+
+            if len(tweet_destinations) > 0:
+                new_tweets.append((tweet, tweet_destinations))
+
+        if len(new_tweets) > 0:
+            connect_destinations()
+            load_recent_fingerprints()
+
+            new_tweets = [ (tweet, [ destination for destination in tweet_destinations if destination in destinations ]) for tweet, tweet_destinations in new_tweets ]
+            new_tweets = [ (tweet, tweet_destinations) for tweet, tweet_destinations in new_tweets if len(tweet_destinations) > 0 ]
+
+        # Prepare and post them.
+        if args.parallel_conversations <= 1:
+            for tweet, toots in prepare_toots(new_tweets):
+                for destination, toot in toots.items():
+                    handle_prepared_toot(destination, tweet, toot)
+        else:
+            post_conversations(prepare_toots(new_tweets))
+
+
+    # Backfill the tweets of the last `max_days` days, window by window and oldest first (see `--backfill`).
+    # Note: only one window of tweets is in memory at once, the progress is checkpointed after each window, and a run stops
+    #   backfilling after some time, pausing between windows, so runs of other accounts keep their share of Twitter and Mastodon.
+    def backfill():
+        window_start = backfill_from
+        backfill_until = time.time()
+        backfill_start = time.monotonic()
+        fetched_count = 0
+
+        while window_start < backfill_until:
+            if time.monotonic() - backfill_start > kBACKFILL_RUN_SECONDS:
+                log('backfill paused at ', time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(window_start)), ', next run will resume it')
+                break
+
+            window_end = min(window_start + kBACKFILL_WINDOW, backfill_until)
+            window_ids = (tweet_id_at(window_start), tweet_id_at(window_end))
+
+            # > Fetch the window, newest first as twint does.
+            try:
+                if replayed_tweets is not None:
+                    window_tweets = [ tweet for tweet_id, tweet in replayed_tweets.items() if window_ids[0] <= tweet_id < window_ids[1] ]
+                else:
+                    with hosts_scheduler.request('twitter.com', log), metrics.timer('tootbot_fetch_seconds', kind = 'backfill'):
+                        window_tweets = list(fetch_tweets_between(twitter_account, *window_ids, account_path.joinpath('backfill.sjson')))
+            except Exception as e:
+                log('failed to fetch tweets to backfill - ', e)
+                break
+
+            window_tweets.sort(key = lambda tweet: safe_int(tweet['id']), reverse = True)
+            fetched_count += len(window_tweets)
+
+            log('backfill ', len(window_tweets), ' tweets from ', time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(window_start)))
+
+            # > Handle the window, and checkpoint.
+            # > Note: the checkpoint stays `kBACKFILL_INDEX_DELAY` behind the run start, so tweets indexed late by the Twitter search
+            # >   are fetched again by the next run.
+            handle_tweets(window_tweets)
+
+            database.checkpoint_backfill(destinations, min(window_end, backfill_until - kBACKFILL_INDEX_DELAY))
+
+            window_start = window_end
+
+            # > Leave Twitter to other accounts for a while.
+            if window_start < backfill_until and replayed_tweets is None:
+                time.sleep(kBACKFILL_PAUSE)
+
+        metrics.set('tootbot_fetched_tweets', fetched_count)
+
+
+    # Handle tweets.
+    if not args.backfill:
+        handle_tweets(tweets)
+    elif poll_due:
+        backfill()
+
+    # Done.
+    for destination in destinations:
+        metrics.set('tootbot_queued_toots', database.queued_count(destination), mastodon_login = destination.mastodon_login, mastodon_instance = destination.mastodon_instance)
+
+    # > Schedule the next poll, after `delay`, or learned from the posting rate of the account (see `--adaptive-polling`).
+    if poll_due:
+        try:
+            now = time.time()
+
+            if args.adaptive_polling:
+                recent_tweet_id = tweet_id_at(now - kPOLL_RATE_DAYS * 86400)
+
+                recent_tweets_ids = database.recent_tweets_ids(recent_tweet_id)
+                recent_tweets_ids.update(tweet_id for tweet_id in (safe_int(tweet['id']) for tweet in tweets) if tweet_id >= recent_tweet_id)
+                recent_tweets_ids = sorted(recent_tweets_ids, reverse = True)[:kPOLL_RATE_TWEETS]
+
+                poll_delay = poll_interval([ tweet_timestamp(tweet_id) for tweet_id in recent_tweets_ids ], now, delay if delay > 0 else kPOLL_MIN_INTERVAL, logger = log)
+            else:
+                poll_delay = delay
+
+            database.schedule_poll(destinations, now, now + poll_delay)
+
+            if poll_delay > 0:
+                log('next poll in ', round(poll_delay), ' seconds')
+
+            metrics.set('tootbot_poll_interval_seconds', poll_delay)
+        except Exception as e:
+            log('cannot schedule next poll - ', e)
+
+    # > Forget fingerprints of toots too old to be duplicated, and medias not reused anymore.
+    if args.skip_duplicates is not None:
+        try:
+            database.prune_fingerprints(time.time() - args.skip_duplicates * 3600)
+        except Exception as e:
+            log('cannot prune toots fingerprints - ', e)
+
+    if medias_store is not None:
+        try:
+            pruned_count = medias_store.prune()
+
+            if pruned_count > 0:
+                log('removed ', pruned_count, ' medias from the medias store')
+        except Exception as e:
+            log('cannot prune medias store - ', e)
+
+    # > Save what has been learned about links hosts.
+    try:
+        unredir_policy.save()
+    except Exception as e:
+        log('cannot save links resolution policy - ', e)
+
+    # > Apply retention policy, and give freed pages back to the file system.
+    if args.prune_days is not None:
+        try:
+            for destination in destinations:
+
+                # > Don't mark the tweets a backfill in progress didn't reach yet as processed.
+                kept_after = backfilled_until(destination) if args.backfill else None
+
+                pruned_count = database.prune_tweets(destination, time.time(), args.prune_days, args.prune_conversation_days if args.prune_conversation_days is not None else args.prune_days, kept_after)
+
+                if pruned_count > 0:
+                    destination_logger(destination, log)('forgot ', pruned_count, ' tweets older than ', args.prune_days, ' days')
+
+            database.incremental_vacuum()
+        except Exception as e:
+            log('cannot prune database - ', e)
+
+    metrics.set('tootbot_last_run_success', 1)
+
+    another_pass = run_lock.requested_pass()
+
+    if another_pass is not None:
+        log('another run was requested meanwhile, start one more pass', '' if another_pass == run_request else ' for it')
+
+    log('done')
+    print('')
@@ -0,0 +1,201 @@
+# Videos probes, downloads and recompressions.
+
+import os
+import json
+import subprocess
+from contextlib import nullcontext
+from decimal import Decimal
+from urllib.parse import urlsplit
+
+from .config import kVIDEO_MIN_BITRATE
+from .hosts import HostBlockedError
+from .utils import unlink_noerr
+
+
+# Raised when a video can't fit a size limit, even recompressed (see `kVIDEO_MIN_BITRATE`).
+class VideoTooBigError(Exception):
+    pass
+
+# Fetch the metadata of a video (duration, formats, sizes...) without downloading it.
+def probe_video(video_url):
+    result = subprocess.run("yt-dlp -J --no-playlist '%s'" % (video_url), shell = True, capture_output = True, text = True, check = True, timeout = 60)
+
+    return json.loads(result.stdout)
+
+# Select the format of a video to download for a size limit, from its metadata. Return the format id, or None if it can't be decided.
+# Note: the largest format fitting the limit is preferred, as it doesn't need to be recompressed. Else, the smallest format
+#   above the bitrate needed to fit the limit is downloaded, higher ones would be lost by the recompression anyway.
+def select_video_format(video_info, max_video_size, logger = None):
+
+    # Logger helper.
+    def llogger(*args):
+        if logger is not None:
+            logger(*args)
+
+    duration = video_info.get('duration')
+    formats = [ format for format in video_info.get('formats') or [] if format.get('vcodec') != 'none' and format.get('format_id') is not None ]
+
+    # > Skip video only formats, unless the video is silent.
+    if any(format.get('acodec') != 'none' for format in formats):
+        formats = [ format for format in formats if format.get('acodec') != 'none' ]
+
+    # > Pick the largest format which can be posted as is.
+    def size(format):
+        if format.get('filesize') or format.get('filesize_approx'):
+            return format.get('filesize') or format.get('filesize_approx')
+
+        if format.get('tbr') and duration:
+            return format['tbr'] * 1000 / 8 * duration
+
+        return None
+
+    fitting_formats = [ format for format in formats if format.get('ext') == 'mp4' and size(format) is not None and size(format) <= max_video_size ]
+
+    if len(fitting_formats) > 0:
+        format = max(fitting_formats, key = size)
+        llogger('video format ', format['format_id'], ' fits without recompression (', round(size(format)), ' bytes)')
+
+        return format['format_id']
+
+    if not duration:
+        return None
+
+    # > Check it can be recompressed at an acceptable bitrate.
+    target_bitrate_kbit_s = max_video_size * 8 / 1000 / duration
+
+    if target_bitrate_kbit_s < kVIDEO_MIN_BITRATE:
+        raise VideoTooBigError('video too long (%s seconds), it would need a bitrate of %s kbit/s' % (round(duration), round(target_bitrate_kbit_s)))
+
+    # > Pick the smallest format above the target bitrate, or the largest one.
+    formats = [ format for format in formats if format.get('tbr') ]
+
+    if len(formats) == 0:
+        return None
+
+    above_formats = [ format for format in formats if format['tbr'] >= target_bitrate_kbit_s ]
+    format = min(above_formats, key = lambda format: format['tbr']) if len(above_formats) > 0 else max(formats, key = lambda format: format['tbr'])
+
+    llogger('video format ', format['format_id'], ' will be recompressed (', round(format['tbr']), ' -> ', round(target_bitrate_kbit_s), ' kbit/s)')
+
+    return format['format_id']
+
+# Download a video, in a format fitting a size limit if possible (see `recompress_video()` otherwise).
+# Note: only the `yt-dlp` calls hold a slot of the hosts scheduler, if given, so recompressions don't delay other requests to the host.
+def download_video(video_url, video_path, max_video_size, logger = None, hosts_scheduler = None):
+
+    max_video_size_mib = max_video_size / (1024 * 1024)
+
+    # Logger helper.
+    def llogger(*args):
+        if logger is not None:
+            logger(*args)
+
+    # Host request helper.
+    def host_request():
+        if hosts_scheduler is None:
+            return nullcontext()
+
+        return hosts_scheduler.request(urlsplit(video_url)[1], logger)
+    
+    # Remove file, in case the directory is dirty.
+    unlink_noerr(video_path)
+
+    # Probe video, to download a format which doesn't need to be recompressed, or fail before downloading anything.
+    format_selector = "b -S 'filesize~%sM'" % (str(max_video_size_mib))
+
+    try:
+        with host_request():
+            video_info = probe_video(video_url)
+
+        format_id = select_video_format(video_info, max_video_size, llogger)
+
+        if format_id is not None:
+            format_selector = "'%s'" % (format_id)
+
+    except (VideoTooBigError, HostBlockedError):
+        raise
+
+    except Exception as e:
+        llogger('cannot probe the video, let yt-dlp select the format - ', e)
+
+    # Download video.
+    llogger("downloading the video")
+
+    try:
+        with host_request():
+            subprocess.run("yt-dlp -o '%s' -N 8 -f %s --recode-video mp4 --no-playlist --max-filesize 500M '%s'" %
+                            (str(video_path), format_selector, video_url), shell = True, capture_output = False, check = True, timeout = 300)
+    except Exception as e:
+        unlink_noerr(video_path)
+        raise
+    
+    llogger("video downloaded")
+
+# Recompress a downloaded video, if it's bigger than a size limit.
+def recompress_video(video_path, max_video_size, logger = None):
+
+    max_video_size_mib = max_video_size / (1024 * 1024)
+
+    # Logger helper.
+    def llogger(*args):
+        if logger is not None:
+            logger(*args)
+
+    # Recompress
+    try:
+        tmp_video_path = video_path.with_name('tmp-' + video_path.name)
+        pass_video_path_prefix = video_path.with_name(video_path.name + '-ffmpeg2pass')
+
+        size = os.lstat(video_path).st_size
+                    
+        if size > max_video_size:
+            llogger('video too big (%s > %s), recompressing' % (size, max_video_size))
+            
+            # > Compute the needed bitrate.
+            duration_result = subprocess.run("ffprobe -v error -show_entries format=duration -of csv=p=0 '%s'"
+                                             % (str(video_path)),
+                                             shell = True, capture_output = True, text = True, check = True)
+            
+            audio_bitrate_result = subprocess.run("ffprobe -v error -select_streams a:0 -show_entries stream=bit_rate -of csv=p=0 '%s'"
+                                                  % (str(video_path)),
+                                                  shell = True, capture_output=True, text = True, check = True)
+
+            duration_dec = Decimal(duration_result.stdout)
+            audio_bitrate_dec = Decimal(audio_bitrate_result.stdout)
+                        
+            if audio_bitrate_dec > Decimal(128000):
+                audio_bitrate_dec = Decimal(128000)
+                        
+            target_audio_bitrate_kbit_s = audio_bitrate_dec / Decimal(1000.0)
+            target_video_bitrate_kbit_s = (Decimal(max_video_size_mib) * Decimal(8192.0)) / (Decimal(1.048576) * duration_dec) - target_audio_bitrate_kbit_s
+                        
+            if target_video_bitrate_kbit_s <= Decimal(0):
+                raise Exception('result in negative bitrate ', target_video_bitrate_kbit_s)
+
+            # > Remove previous pass files, in case the directory is dirty.
+            for path in pass_video_path_prefix.parent.glob(pass_video_path_prefix.name + '*'):
+                unlink_noerr(path)
+
+            # > Encode the video in 2 passes, for better size accuracy.
+            subprocess.run("ffmpeg -y -i '%s' -c:v libx264 -b:v %sk -pass 1 -an -f mp4 -passlogfile '%s' -loglevel error -stats /dev/null" %
+                           (str(video_path), str(target_video_bitrate_kbit_s), str(pass_video_path_prefix)),
+                           shell = True, capture_output = False, check = True)
+            
+            subprocess.run("ffmpeg -y -i '%s' -c:v libx264 -b:v %sk -pass 2 -c:a aac -b:a %sk -passlogfile '%s' -loglevel error -stats '%s'"
+                           % (str(video_path), str(target_video_bitrate_kbit_s), str(target_audio_bitrate_kbit_s), str(pass_video_path_prefix), str(tmp_video_path)),
+                           shell = True, capture_output = False, check = True)
+            
+            # Move files.
+            video_path.unlink()
+            tmp_video_path.rename(video_path)
+
+    except Exception as e:
+            llogger('unable to recompress video - ', e)
+
+    finally:
+        # > Remove pass files, in case the directory is dirty.
+        for path in pass_video_path_prefix.parent.glob(pass_video_path_prefix.name + '*'):
+            unlink_noerr(path)
+        
+        # > Remove temp file.
+        unlink_noerr(tmp_video_path)
@@ -0,0 +1,180 @@
+# Metrics, exported as a node_exporter textfile.
+
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Outcome names, indexed by the (negative) 'toot_id' stored in database.
+kOUTCOME_NAMES = {
+    -1: 'too_long',
+    -2: 'reply_or_toot_too_big',
+    -3: 'bogus_retweet',
+    -4: 'retweet_too_long',
+    -5: 'quote_too_long',
+    -6: 'post_failed',
+    -7: 'duplicate'
+    }
+
+# Histograms buckets, in seconds.
+kLATENCY_BUCKETS = [ 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600 ]
+
+# Metrics descriptions: name -> (type, help).
+kMETRICS = {
+    'tootbot_runs_total': ('counter', 'Number of runs.'),
+    'tootbot_last_run_timestamp_seconds': ('gauge', 'Unix time of the end of the last run.'),
+    'tootbot_last_run_duration_seconds': ('gauge', 'Duration of the last run.'),
+    'tootbot_last_run_success': ('gauge', 'Whether the last run reached its end (1) or exited on error (0).'),
+    'tootbot_fetched_tweets': ('gauge', 'Number of tweets fetched by the last run.'),
+    'tootbot_tweets_total': ('counter', 'Number of handled tweets, by outcome code.'),
+    'tootbot_queued_toots': ('gauge', 'Number of toots waiting in the retry queue at the end of the last run.'),
+    'tootbot_poll_interval_seconds': ('gauge', 'Delay until the next poll of the account, set by the last run which polled it.'),
+    'tootbot_uploaded_bytes_total': ('counter', 'Number of media bytes uploaded to Mastodon.'),
+    'tootbot_retries_total': ('counter', 'Number of retried Mastodon calls, by error class.'),
+    'tootbot_fetch_seconds': ('histogram', 'Duration of tweets fetches.'),
+    'tootbot_unredir_seconds': ('histogram', 'Duration of links resolutions.'),
+    'tootbot_media_seconds': ('histogram', 'Duration of medias downloads and uploads.'),
+    'tootbot_post_seconds': ('histogram', 'Duration of toots posts, retries included.')
+    }
+
+# Collect metrics, and persist them as a node_exporter textfile.
+# Note: a run is a short-lived process, so counters and histograms are accumulated in a JSON state file,
+#   to keep them monotonic across runs as Prometheus expects.
+class Metrics:
+
+    def __init__(self):
+        self.base_labels = { }
+        self.values = { }
+        self.histograms = { }
+        self.lock = threading.Lock()
+
+    # Series key, hashable and sorted.
+    def key(self, name, labels):
+        all_labels = dict(self.base_labels)
+        all_labels.update({ label: str(value) for label, value in labels.items() })
+
+        return (name, tuple(sorted(all_labels.items())))
+
+    # Increment a counter.
+    def inc(self, name, value = 1, **labels):
+        key = self.key(name, labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    # Set a gauge.
+    def set(self, name, value, **labels):
+        key = self.key(name, labels)
+
+        with self.lock:
+            self.values[key] = value
+
+    # Add an observation to an histogram.
+    def observe(self, name, value, **labels):
+        key = self.key(name, labels)
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = { 'buckets': [ 0 ] * len(kLATENCY_BUCKETS), 'sum': 0.0, 'count': 0 }
+                self.histograms[key] = histogram
+
+            for index, bound in enumerate(kLATENCY_BUCKETS):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    # Observe the duration of a block of code.
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start, **labels)
+
+    # Load accumulated values.
+    def load(self, state_path):
+        try:
+            with open(state_path, 'r') as file:
+                state = json.load(file)
+        except Exception:
+            return
+
+        for name, labels, value in state.get('values', []):
+            if kMETRICS.get(name, ('gauge',))[0] == 'counter':
+                key = (name, tuple(sorted(labels.items())))
+                self.values[key] = self.values.get(key, 0) + value
+
+        for name, labels, histogram in state.get('histograms', []):
+            if len(histogram['buckets']) == len(kLATENCY_BUCKETS):
+                self.histograms[(name, tuple(sorted(labels.items())))] = histogram
+
+    # Save accumulated values.
+    def save(self, state_path):
+        state = {
+            'values': [ [ key[0], dict(key[1]), value ] for key, value in self.values.items() ],
+            'histograms': [ [ key[0], dict(key[1]), histogram ] for key, histogram in self.histograms.items() ]
+            }
+
+        tmp_state_path = state_path.with_name(state_path.name + '.tmp')
+
+        with open(tmp_state_path, 'w') as file:
+            json.dump(state, file)
+
+        os.replace(tmp_state_path, state_path)
+
+    # Write metrics in Prometheus text format. The file is replaced atomically, so node_exporter never reads a partial file.
+    def write_textfile(self, textfile_path):
+
+        def format_labels(labels):
+            if len(labels) == 0:
+                return ''
+
+            return '{' + ','.join('%s="%s"' % (label, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for label, value in labels) + '}'
+
+        lines = []
+
+        for name, (metric_type, metric_help) in kMETRICS.items():
+            series = [ (key, value) for key, value in self.values.items() if key[0] == name ]
+            histograms = [ (key, histogram) for key, histogram in self.histograms.items() if key[0] == name ]
+
+            if len(series) == 0 and len(histograms) == 0:
+                continue
+
+            lines.append('# HELP %s %s' % (name, metric_help))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+
+            for key, value in sorted(series):
+                lines.append('%s%s %s' % (name, format_labels(key[1]), value))
+
+            for key, histogram in sorted(histograms, key = lambda item: item[0]):
+                for bound, bucket in zip(kLATENCY_BUCKETS, histogram['buckets']):
+                    lines.append('%s_bucket%s %s' % (name, format_labels(key[1] + (('le', str(bound)),)), bucket))
+
+                lines.append('%s_bucket%s %s' % (name, format_labels(key[1] + (('le', '+Inf'),)), histogram['count']))
+                lines.append('%s_sum%s %s' % (name, format_labels(key[1]), histogram['sum']))
+                lines.append('%s_count%s %s' % (name, format_labels(key[1]), histogram['count']))
+
+        tmp_textfile_path = textfile_path.with_name('.' + textfile_path.name + '.tmp')
+
+        with open(tmp_textfile_path, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+
+        os.replace(tmp_textfile_path, textfile_path)
+
+# Name of a database outcome.
+def outcome_name(toot_id):
+    if toot_id > 0:
+        return 'posted'
+
+    return kOUTCOME_NAMES.get(toot_id, 'unknown')
+
+# Metrics of this process.
+metrics = Metrics()
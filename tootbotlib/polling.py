@@ -0,0 +1,30 @@
+# Adaptive polling: how long to wait before fetching the tweets of an account again, learned from its posting rate.
+
+import random
+
+from .config import kPOLL_INTERVAL_RATIO, kPOLL_MAX_INTERVAL, kPOLL_JITTER
+
+
+# Compute the interval until the next poll (in seconds), from the creation times of the last tweets of the account.
+# The mean interval between tweets runs until now, so it grows while the account stays quiet, and the polls slow down.
+def poll_interval(tweets_timestamps, now, min_interval, max_interval = kPOLL_MAX_INTERVAL, logger = None):
+
+    # Logger helper.
+    def llogger(*args):
+        if logger is not None:
+            logger(*args)
+
+    max_interval = max(min_interval, max_interval)
+
+    if len(tweets_timestamps) == 0:
+        interval = max_interval
+
+        llogger('no recent tweets')
+    else:
+        mean_tweets_interval = max(now - min(tweets_timestamps), 0) / len(tweets_timestamps)
+        interval = min(max(mean_tweets_interval * kPOLL_INTERVAL_RATIO, min_interval), max_interval)
+
+        llogger(len(tweets_timestamps), ' recent tweets, one every ', round(mean_tweets_interval), ' seconds')
+
+    # Jitter, never polling sooner than the minimum interval.
+    return max(min_interval, interval * random.uniform(1 - kPOLL_JITTER, 1 + kPOLL_JITTER))
@@ -0,0 +1,190 @@
+# Posting of medias and toots to Mastodon.
+
+import time
+
+from mastodon.Mastodon import MastodonAPIError, MastodonBadGatewayError, MastodonInternalServerError, MastodonRatelimitError, MastodonNetworkError
+
+from .config import kRATELIMIT_MAX_POST_WAIT
+from .destination import RateLimitWaitError
+from .metrics import metrics
+from .utils import safe_int
+
+
+# Raised when a toot (or media) can't be posted now, but may be posted later.
+class PostDeferredError(Exception):
+    pass
+
+# Post a media to Mastodon. Return int media id.
+# Note: like for toots, transient errors and rate limits longer than `kRATELIMIT_MAX_POST_WAIT` raise `PostDeferredError`
+#   instead of blocking the run, the caller skipping the media.
+def mastodon_media_post(mastodon_api, data, mime_type, logger = None, rate_limiter = None):
+
+    # Logger helper.
+    def llogger(*args):
+        if logger is not None:
+            logger(*args)
+
+    # Prepate things.
+    try_count = 0
+
+    # Re-try loop.
+    while True:
+        try_count = try_count + 1
+
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire('media', llogger, kRATELIMIT_MAX_POST_WAIT)
+
+            media_posted = mastodon_api.media_post(data, mime_type = mime_type)
+
+            if rate_limiter is not None:
+                rate_limiter.update('media', mastodon_api)
+
+            return safe_int(media_posted['id'])
+
+        except RateLimitWaitError as e:
+            raise PostDeferredError(str(e))
+
+        except MastodonRatelimitError as e:
+            metrics.inc('tootbot_retries_total', operation = 'media_post', error_class = 'rate_limited')
+
+            if rate_limiter is None or try_count >= 10:
+                raise PostDeferredError('rate limited by server - ' + str(e))
+            else:
+                llogger('media upload rate limited by server, will retry when the limit resets - ', e)
+                rate_limiter.update('media', mastodon_api, limited = True)
+                        
+        except MastodonBadGatewayError as e:
+            metrics.inc('tootbot_retries_total', operation = 'media_post', error_class = 'bad_gateway')
+            raise PostDeferredError('bad gateway - ' + str(e))
+
+        except MastodonInternalServerError as e:
+            metrics.inc('tootbot_retries_total', operation = 'media_post', error_class = 'internal_server_error')
+            raise PostDeferredError('internal server error - ' + str(e))
+                        
+        except Exception as e:
+            raise
+
+# Post a toot to mastodon. Return toot dictionary.
+# Note: transient errors are not retried here, they raise `PostDeferredError` so the caller can queue the toot
+#   and go on with the next tweets instead of blocking on a sick server. So are rate limits longer than `kRATELIMIT_MAX_POST_WAIT`.
+def mastodon_post(mastodon_api, tweet_content, in_reply_to_id, photos_ids, videos_ids, logger = None, rate_limiter = None, medias_uploaded_at = None):
+
+    # Logger helper.
+    def llogger(*args):
+        if logger is not None:
+            logger(*args)
+
+    # Prepare things.
+    try_count = 0
+    medias_ids = photos_ids + videos_ids
+
+    # Wait a bit for media to be ready on server side.
+    # Note: `medias_uploaded_at` is the `time.monotonic()` of the last upload, if known, so we only wait for what's left.
+    if len(medias_ids) > 0:
+        if medias_uploaded_at is None:
+            time.sleep(5)
+        else:
+            time.sleep(max(0, 5 - (time.monotonic() - medias_uploaded_at)))
+
+    # Re-try loop.
+    while True:
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire('status', llogger, kRATELIMIT_MAX_POST_WAIT)
+
+            toot = mastodon_api.status_post(tweet_content,
+                                            in_reply_to_id = in_reply_to_id,
+                                            media_ids = medias_ids,
+                                            sensitive = False,
+                                            visibility = 'unlisted',
+                                            spoiler_text = None)
+
+            if rate_limiter is not None:
+                rate_limiter.update('status', mastodon_api)
+            
+            return toot
+
+        except MastodonRatelimitError as e:
+            try_count = try_count + 1
+
+            metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'rate_limited')
+
+            if rate_limiter is None or try_count >= 10:
+                raise PostDeferredError('rate limited by server - ' + str(e))
+            else:
+                llogger('toot rate limited by server, will retry when the limit resets - ', e)
+                rate_limiter.update('status', mastodon_api, limited = True)
+
+        except RateLimitWaitError as e:
+            raise PostDeferredError(str(e))
+
+        except MastodonNetworkError as e:
+            metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'network_error')
+            raise PostDeferredError('network error - ' + str(e))
+        
+        except MastodonAPIError as e:
+            description = str(e).lower()
+            try_count = try_count + 1
+
+            # (Fragile) specific error catching. Would be better if Mastodon also return a simple token we can match.
+            if '422' in description and 'Unprocessable Entity'.lower() in description and 'Try again in a moment'.lower() in description:
+                metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'media_processing')
+                raise PostDeferredError('medias are still processing')
+
+            elif '422' in description and 'Unprocessable Entity'.lower() in description and 'Cannot attach a video to a post that already contains images'.lower() in description:
+                if try_count >= 2:
+                    raise Exception('Unexpected mixed images and videos')
+                else:
+                    llogger('mixed images and videos, will retry in 1 second with only videos - ', e)
+                    medias_ids = videos_ids
+                    metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'mixed_medias')
+                    time.sleep(1)
+
+            elif '422' in description and 'Unprocessable Entity'.lower() in description and 'Cannot attach more than'.lower() in description:
+                if medias_ids is None or len(medias_ids) == 0:
+                    raise Exception('Unexpected too much attached medias')
+                else:
+                    llogger('too much medias, will retry in 1 second with last one removed - ', e)
+
+                    medias_ids.pop()
+
+                    if len(medias_ids) == 0:
+                        medias_ids = None
+                
+                    metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'too_much_medias')
+                    time.sleep(1)
+
+            elif '422' in description and 'Unprocessable Entity'.lower() in description and 'text character limit of'.lower() in description:
+                llogger('toot is to big')
+                return { 'id' : -2 } # This error will never solve, we don't want to retry forever: give an invalid toot_id to consider it as processed.
+            
+            elif '422' in description and 'Text can\'t be blank'.lower() in description:
+
+                if len(medias_ids) == 0:
+                    raise Exception('Unexpected blank toot without medias')
+
+                if try_count >= 2:
+                    raise Exception('Unexpected blank toot')
+                else:
+                    llogger('tweet is blank, will retry in 1 second by using a space - ', e)
+
+                    tweet_content = ' '
+                    metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'blank_text')
+                    time.sleep(1)
+
+            elif '404' in description and 'the post you are trying to reply'.lower() in description:
+                if try_count >= 2:
+                    raise Exception('Unexpected "reply to" error')
+                else:
+                    llogger('the "reply to" id doesn\'t exist, will retry in 1 second without it - ', e)
+                    in_reply_to_id = None
+                    metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'missing_reply_to')
+                    time.sleep(1)
+            
+            else:
+                metrics.inc('tootbot_retries_total', operation = 'status_post', error_class = 'unknown_api_error')
+                raise PostDeferredError('got an unknown API error - ' + str(e))
+
+        except Exception as e:
+            raise
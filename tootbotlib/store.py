@@ -0,0 +1,162 @@
+# Content addressed medias store, shared by all the accounts running from the same directory (see `--medias-store`).
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from .config import kMEDIAS_STORE_LOCKS, kMEDIAS_STORE_TTL
+from .utils import unlink_noerr
+
+
+# Hash of a media content, given as bytes or as a file path.
+def content_hash(content):
+    if not isinstance(content, Path):
+        return hashlib.sha256(content).hexdigest()
+
+    digest = hashlib.sha256()
+
+    with open(content, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Medias downloaded (and recompressed) by a run, so other runs and accounts reuse them instead of fetching them again.
+# Contents are stored once by hash in 'blobs/', and each key (a resolved URL, and the processing parameters) points to
+#   its content in 'keys/'. Keys expire `kMEDIAS_STORE_TTL` seconds after being stored, and contents once unused as long.
+# Note: fetches of the same key are serialized with a lock file, so concurrent runs download a media only once. Keys share
+#   a fixed set of lock files in 'locks/' (by hash), so they don't pile up.
+class MediasStore:
+
+    def __init__(self, path):
+        self.blobs_path = path.joinpath('blobs')
+        self.keys_path = path.joinpath('keys')
+        self.locks_path = path.joinpath('locks')
+
+        os.makedirs(self.blobs_path, exist_ok = True)
+        os.makedirs(self.keys_path, exist_ok = True)
+        os.makedirs(self.locks_path, exist_ok = True)
+
+    # Path of the entry of a key.
+    def key_path(self, key):
+        return self.keys_path.joinpath(hashlib.sha256(json.dumps(key).encode()).hexdigest() + '.json')
+
+    # Lock a key, until its media is in the store.
+    @contextmanager
+    def locked(self, key):
+        lock_nbr = int(self.key_path(key).stem, 16) % kMEDIAS_STORE_LOCKS
+
+        with open(self.locks_path.joinpath('%s.lock' % (lock_nbr)), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Find the media of a key. Return `(path, content_type, content_hash)`, or None.
+    def get(self, key):
+        try:
+            with open(self.key_path(key), 'r') as file:
+                entry = json.load(file)
+        except Exception:
+            return None
+
+        blob_path = self.blobs_path.joinpath(entry['hash'])
+
+        if entry['stored_at'] + kMEDIAS_STORE_TTL < time.time() or not blob_path.exists():
+            return None
+
+        # > Keep used contents.
+        try:
+            os.utime(blob_path)
+        except Exception:
+            pass
+
+        return (blob_path, entry['content_type'], entry['hash'])
+
+    # Store the media of a key, given as bytes or as a file path (the file is moved to the store).
+    # Return `(path, content_type, content_hash)`.
+    def put(self, key, content, content_type):
+        media_hash = content_hash(content)
+        blob_path = self.blobs_path.joinpath(media_hash)
+
+        # > Store the content, unless the same one is already there.
+        if blob_path.exists():
+            if isinstance(content, Path):
+                unlink_noerr(content)
+
+            os.utime(blob_path)
+        else:
+            tmp_path = blob_path.with_suffix('.tmp-%s-%s' % (os.getpid(), threading.get_ident()))
+
+            if isinstance(content, Path):
+                shutil.move(content, tmp_path)
+            else:
+                with open(tmp_path, 'wb') as file:
+                    file.write(content)
+
+            os.replace(tmp_path, blob_path)
+
+        # > Point the key to it.
+        key_path = self.key_path(key)
+        tmp_path = key_path.with_suffix('.tmp-%s-%s' % (os.getpid(), threading.get_ident()))
+
+        with open(tmp_path, 'w') as file:
+            json.dump({ 'hash': media_hash, 'content_type': content_type, 'stored_at': time.time() }, file)
+
+        os.replace(tmp_path, key_path)
+
+        return (blob_path, content_type, media_hash)
+
+    # Find the media of a key, or download it with `download()`, which returns `(content, content_type)` or None.
+    # Return `(path, content_type, content_hash)`, or None if it can't be downloaded.
+    def fetch(self, key, download, logger = None):
+
+        # Logger helper.
+        def llogger(*args):
+            if logger is not None:
+                logger(*args)
+
+        with self.locked(key):
+            entry = self.get(key)
+
+            if entry is not None:
+                llogger('found in medias store - ', entry[2])
+                return entry
+
+            downloaded = download()
+
+            if downloaded is None:
+                return None
+
+            return self.put(key, *downloaded)
+
+    # Remove expired keys, and contents not used anymore. Return the number of removed contents.
+    def prune(self):
+        expired_at = time.time() - kMEDIAS_STORE_TTL
+        pruned_count = 0
+
+        for path in self.keys_path.iterdir():
+            try:
+                if path.stat().st_mtime < expired_at:
+                    unlink_noerr(path)
+            except Exception:
+                pass
+
+        for path in self.blobs_path.iterdir():
+            try:
+                if path.stat().st_mtime < expired_at:
+                    unlink_noerr(path)
+                    pruned_count += 1
+            except Exception:
+                pass
+
+        return pruned_count
@@ -0,0 +1,136 @@
+# Tweets fetches, with twint.
+
+'''
+Note:
+- https://github.com/twintproject/twint (Twint) have been archived for some obscure reason.
+- https://github.com/twintproject/twint-zero (Twint-Zero) Seems that the designated successor.
+
+It will probably require to switch to it at some point.
+
+It has some advantages (simple interface, direct JSON output on stdout, etc.), but is too limited for
+  now to use it as a replacement (some links are missing, like videos one, there is no conversation_id, no quote URL...)
+
+Let stay on Twint for now.
+'''
+
+import json
+import subprocess
+import threading
+from pathlib import Path, PurePath
+from urllib.parse import urlsplit, urlunsplit
+
+from .utils import safe_int, unlink_noerr
+
+
+# Fetch Twitter tweet.
+# Note: with replayed tweets (see `--replay`), the tweet is looked up in them instead.
+def fetch_tweet(tweet_url, tmp_dir_path = Path('/tmp/'), replayed_tweets = None):
+    # Parse URL.
+    parse_result = urlsplit(tweet_url)
+    url_scheme = parse_result[0]
+    url_host = parse_result[1]
+    url_path = parse_result[2]
+    clean_url = urlunsplit((url_scheme, url_host, url_path, None, None))
+
+    # Parse path.
+    path = PurePath(url_path)
+
+    # Validate.
+    if url_scheme != 'http' and url_scheme != 'https':
+        raise Exception('invalid scheme "' + url_scheme + '"')
+
+    if len(path.parts) != 4:
+        raise Exception('invalid path "' + str(path) + '"')
+    
+    # Extract parts.
+    twitter_username = path.parts[1]
+    tweet_id = safe_int(path.parts[3])
+
+    if replayed_tweets is not None:
+        return (twitter_username, tweet_id, replayed_tweets.get(tweet_id))
+
+    # Fetch tweet.
+    # > Note: the same tweet can be fetched concurrently by several threads (see `--pipeline`).
+    tmp_name = twitter_username + '_' + str(tweet_id) + '_' + str(threading.get_ident())
+    tmp_sjson_path = tmp_dir_path.joinpath(tmp_name + '.sjson')
+    tmp_json_path = tmp_dir_path.joinpath(tmp_name + '.json')
+
+    for attempt in [ 0, 1, 2 ]:
+        if attempt == 0:
+            try:
+                subprocess.run("twint -u '%s' -s 'since_id:%s and max_id:%s' --full-text --limit 1 --json -o '%s'" %
+                                (twitter_username, str(tweet_id - 1), str(tweet_id), str(tmp_sjson_path)), shell = True, capture_output = True, check = True, timeout = 15)
+
+                subprocess.run("jq -s . '%s' > '%s'" % (str(tmp_sjson_path), str(tmp_json_path)), shell = True, capture_output = True, check = True)
+                
+                unlink_noerr(tmp_sjson_path)
+
+                break
+            except Exception as e:
+                unlink_noerr(tmp_sjson_path)
+                unlink_noerr(tmp_json_path)
+
+        elif attempt == 1:
+            try:
+                subprocess.run("twint -u '%s' -s 'max_id:%s' --full-text --limit 20 --json -o '%s'" %
+                                (twitter_username, str(tweet_id), str(tmp_sjson_path)), shell = True, capture_output = True, check = True, timeout = 15)
+
+                subprocess.run("jq -s . '%s' > '%s'" % (str(tmp_sjson_path), str(tmp_json_path)), shell = True, capture_output = True, check = True)
+                
+                unlink_noerr(tmp_sjson_path)
+
+                break
+            except Exception as e:
+                unlink_noerr(tmp_sjson_path)
+                unlink_noerr(tmp_json_path)
+        
+        else:
+            unlink_noerr(tmp_sjson_path)
+            unlink_noerr(tmp_json_path)
+            
+            return (twitter_username, tweet_id, None)
+
+    # Parse JSON.
+    try:
+        tweets = json.load(open(tmp_json_path, 'r'))
+    except Exception as e:
+        return (twitter_username, tweet_id, None)
+    finally:
+        unlink_noerr(tmp_json_path)
+
+    # Check we found the tweet
+    for tweet in tweets:
+
+        if safe_int(tweet['id']) != tweet_id and safe_int(tweet['conversation_id']) != tweet_id and tweet['link'].lower() != clean_url.lower():
+            continue
+
+        return (twitter_username, tweet_id, tweet)
+    
+    # Fallback.
+    return (twitter_username, tweet_id, None)
+
+
+# Fetch the tweets of an account with ids in `[min_id, end_id)`, e.g. created in a time window (see `tweet_id_at()`).
+# Tweets are yielded one at a time as twint wrote them, newest first, so a large window is not loaded in memory at once.
+def fetch_tweets_between(twitter_username, min_id, end_id, sjson_path, timeout = 300):
+    unlink_noerr(sjson_path)
+
+    try:
+        subprocess.run("twint -u '%s' -s 'since_id:%s and max_id:%s' --full-text --json -o '%s'" %
+                        (twitter_username, str(min_id - 1), str(end_id - 1), str(sjson_path)), shell = True, capture_output = True, check = True, timeout = timeout)
+
+        # > No file when there is no tweet.
+        if not sjson_path.exists():
+            return
+
+        with open(sjson_path, 'r') as file:
+            for line in file:
+                if len(line.strip()) == 0:
+                    continue
+
+                tweet = json.loads(line)
+
+                if min_id <= safe_int(tweet['id']) < end_id:
+                    yield tweet
+    finally:
+        unlink_noerr(sjson_path)
@@ -0,0 +1,169 @@
+# Small helpers, shared by all the stages.
+
+import os
+import fcntl
+import json
+import hashlib
+from contextlib import contextmanager
+
+from .config import kTWITTER_EPOCH
+
+
+# Remove a file and ignore errors.
+def unlink_noerr(file_path):
+    try:
+        file_path.unlink();
+    except:
+        pass
+
+# Return an integer from int or str.
+def safe_int(value):
+
+    if value is None:
+        return None
+
+    if isinstance(value, int):
+        return value
+    
+    try:
+        return int(value)
+    except:
+        return -1
+
+# Safely fetch an object in a hierarchy of objects.
+def safe_dict(dict, path, default = None):
+    parts = path.split('.')
+    value = dict
+
+    try:
+        for part in parts:
+            value = value[part]
+    except:
+        return default
+    
+    return value
+
+# Smallest tweet id which could have been created at a given time (in seconds since epoch).
+def tweet_id_at(timestamp):
+    return max(int(timestamp * 1000) - kTWITTER_EPOCH, 0) << 22
+
+# Creation time of a tweet (Unix time), from its id.
+def tweet_timestamp(tweet_id):
+    return ((tweet_id >> 22) + kTWITTER_EPOCH) / 1000
+
+# Fingerprint of a toot, to find duplicates (see `--skip-duplicates`): its text, ignoring case and spaces, and its medias contents hashes.
+def toot_fingerprint(content, medias_hashes):
+    return hashlib.sha256(json.dumps([ ' '.join(content.casefold().split()), sorted(medias_hashes) ]).encode()).hexdigest()
+
+# Replace substrings of a string if it don't make it exceed some length.
+def safe_replace(string, oldvalue, newvalue, max_length, logger = None):
+
+    # Logger helper.
+    def llogger(*args):
+        if logger is not None:
+            logger(*args)
+
+    # Replace
+    result = string.replace(oldvalue, newvalue)
+
+    # Check result.
+    if len(result) > max_length:
+        llogger('can\'t replace "', oldvalue, '" with "', newvalue, '", result is too long - ', len(result), ' > ', max_length)
+        return string
+    
+    return result
+
+# Read-modify-write a JSON state file shared by several processes.
+@contextmanager
+def locked_json_state(state_path):
+    with open(state_path, 'a+') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+
+        file.seek(0)
+
+        try:
+            state = json.loads(file.read() or '{}')
+        except Exception:
+            state = { }
+
+        yield state
+
+        file.seek(0)
+        file.truncate()
+        json.dump(state, file)
+        file.flush()
+
+# Advisory lock of an account directory, so overlapping runs of the same account don't fetch, download and post
+#   the same tweets. A run finding the lock held leaves its request (its arguments) in a pending file, and the run
+#   holding it does one more pass for each distinct request when it's done, so overlapping invocations of the same
+#   command line are coalesced into a single extra pass, and the ones for other destinations are still served.
+class RunLock:
+    def __init__(self, lock_path, pending_path):
+        self.lock_path = lock_path
+        self.pending_path = pending_path
+        self.file = None
+
+    # Take the lock for a request. Return False if it's held by another run, after leaving the request in the pending
+    #   file, unless `request_pass` is False and the running one serves the same request.
+    def acquire(self, request, request_pass = True):
+        file = open(self.lock_path, 'a+')
+
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.seek(0)
+            running_request = file.read().split('\n', 1)[-1]
+            file.close()
+
+            if request_pass or running_request != json.dumps(request):
+                self.update_requests(lambda requests: requests + [ request ])
+
+            return False
+
+        # > Requests made before we got the lock, for the same command line, are served by this pass.
+        self.update_requests(lambda requests: [ pending_request for pending_request in requests if pending_request != request ])
+
+        file.seek(0)
+        file.truncate()
+        file.write('%s\n%s' % (os.getpid(), json.dumps(request)))
+        file.flush()
+
+        self.file = file
+
+        return True
+
+    # Update the pending requests (one JSON list of arguments per line), under the lock of the pending file. Return them.
+    def update_requests(self, update):
+        with open(os.open(self.pending_path, os.O_RDWR | os.O_CREAT, 0o600), 'r+') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+
+            requests = []
+
+            for line in file.read().splitlines():
+                try:
+                    requests.append(json.loads(line))
+                except Exception:
+                    pass
+
+            requests = update(requests)
+
+            file.seek(0)
+            file.truncate()
+            file.write(''.join(json.dumps(request) + '\n' for request in requests))
+
+        return requests
+
+    # Next request to serve, or None. It's left in the pending file until the run serving it takes the lock.
+    def requested_pass(self):
+        requests = self.update_requests(lambda requests: requests)
+
+        return requests[0] if len(requests) > 0 else None
+
+# Concatenate string representation of random objets.
+def stringify(*args):
+    result = ''
+
+    for arg in args:
+        result += str(arg)
+
+    return result